@@ -1,25 +1,40 @@
-from flask import Flask, request, jsonify, session, send_file
+from flask import Flask, request, jsonify, session, send_file, g, Response
 from flask_cors import CORS
 import pandas as pd
 import os
 import io
+import json
+import base64
+import hashlib
 from datetime import datetime, timedelta
 import pytz  
 import openpyxl
-from openpyxl.styles import NamedStyle
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.utils import get_column_letter
-from docx import Document
-from docx.shared import Inches, Pt
-from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
-from barcode import Code128
-from barcode.writer import ImageWriter
 import tempfile
-import random
-import string
-from db_config import get_db_connection
-import traceback
-from barcode.writer import SVGWriter
-import cairosvg
+import db_config
+from db_config import get_db_connection, pool as db_pool
+import metrics
+import time
+from student_cache import StudentCache
+from today_state import TodayState
+from jobs import JobQueue
+from roster import (STUDENT_COLUMNS, ROSTER_MATCH_ON, roster_frames, frame_rows, validate_roster,
+                    diff_roster, update_students, insert_students)
+from labels import LabelDocument, LABEL_LAYOUT, DOCX_MIMETYPE
+from label_pdf import LabelPDF, PDF_MIMETYPE
+from label_groups import GROUP_COLUMNS, stream_group_labels
+import barcode_render
+from barcode_allocator import BarcodeAllocator
+from write_behind import AttendanceWriter, WriterBusy, WRITE_BEHIND_ENABLED
+import atexit
+import csv
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    # Parquet/Arrow exports are optional; the other formats work without pyarrow
+    pa = None
 
 app = Flask(__name__)
 app.secret_key = "your_secret_key"
@@ -31,129 +46,260 @@ PROCESSED_FOLDER = tempfile.gettempdir()
 # Set Philippine timezone (UTC+8)
 PH_TIMEZONE = pytz.timezone('Asia/Manila')
 
-def generate_barcode_image(barcode_number, output_path):
+# Upper bound on events accepted by a single /scan/batch request
+SCAN_BATCH_MAX = int(os.environ.get("SCAN_BATCH_MAX", "1000"))
+
+# Page size for GET /attendance when ?limit= or ?after= is given
+ATTENDANCE_PAGE_SIZE = int(os.environ.get("ATTENDANCE_PAGE_SIZE", "100"))
+ATTENDANCE_PAGE_MAX = int(os.environ.get("ATTENDANCE_PAGE_MAX", "1000"))
+
+# Rows fetched per round trip by GET /attendance?stream=1
+ATTENDANCE_STREAM_CHUNK = int(os.environ.get("ATTENDANCE_STREAM_CHUNK", "500"))
+
+# /filters facets are cached until a student insert (or the TTL, for other processes)
+FILTERS_CACHE_TTL = int(os.environ.get("FILTERS_CACHE_TTL", "300"))
+filters_cache = None
+
+# Attendance exports: rows per fetchmany() and rows sampled for column widths
+EXPORT_FETCH_SIZE = int(os.environ.get("EXPORT_FETCH_SIZE", "1000"))
+EXPORT_WIDTH_SAMPLE = int(os.environ.get("EXPORT_WIDTH_SAMPLE", "200"))
+
+EXPORT_FORMATS = {
+    "xlsx": ("application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "xlsx"),
+    "csv": ("text/csv", "csv"),
+    "parquet": ("application/vnd.apache.parquet", "parquet"),
+    "arrow": ("application/vnd.apache.arrow.file", "arrow")
+}
+
+# Roster uploads run in the background on UPLOAD_WORKERS threads. Job status
+# and results are held in memory, so /upload/<id> only works when the backend
+# runs as a single process (e.g. one gunicorn worker with --threads).
+upload_jobs = JobQueue()
+LABEL_MIMETYPES = {"docx": DOCX_MIMETYPE, "pdf": PDF_MIMETYPE}
+atexit.register(barcode_render.shutdown)
+
+# Unique, non-sequential 12-digit barcodes reserved in blocks
+barcode_allocator = BarcodeAllocator()
+
+# Barcode -> (id, name, department) index for /scan, refreshed on student inserts
+student_cache = StudentCache()
+
+# Today's per-student attendance, loaded at startup and rolled over at PH midnight
+today_state = TodayState()
+
+# Optional write-behind mode: /scan answers from today_state and the writer
+# group-commits the attendance rows. Only safe with a single backend process.
+attendance_writer = None
+
+# today_state only sees scans handled by this process, so GET /attendance for
+# today is served from it only when the backend is declared single-process
+# (BACKEND_SINGLE_PROCESS=1, implied by write-behind); otherwise it uses SQL.
+BACKEND_SINGLE_PROCESS = os.environ.get("BACKEND_SINGLE_PROCESS", "0") == "1" or WRITE_BEHIND_ENABLED
+# Barcode render workers re-import this module as __mp_main__ when app3.py is
+# run directly; they must not start background threads or touch the DB.
+IS_RENDER_WORKER = __name__ == "__mp_main__"
+
+if WRITE_BEHIND_ENABLED and not IS_RENDER_WORKER:
+    attendance_writer = AttendanceWriter(get_db_connection)
+    attendance_writer.start()
+    atexit.register(attendance_writer.stop)
+
+db_config.query_observer = metrics.db_latency.observe
+metrics.Gauges("student_cache", student_cache.stats)
+metrics.Gauges("db_pool", db_pool.stats)
+metrics.Gauges("barcode_cache", barcode_render.cache.stats)
+if attendance_writer:
+    metrics.Gauges("attendance_writer", attendance_writer.stats)
+
+@app.before_request
+def start_request_timer():
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop("request_started", None)
+    if started is not None:
+        route = request.url_rule.rule if request.url_rule else "unmatched"
+        metrics.http_requests.inc(route)
+        metrics.http_latency.observe(route, time.perf_counter() - started)
+        if response.status_code >= 500:
+            metrics.http_errors.inc(route)
+    return response
+
+def preload_state():
+    conn = None
     try:
-        print(f"Generating barcode for {barcode_number} at {output_path}")
-        writer = ImageWriter()
-        print(f"ImageWriter object: {writer}")
-        if output_path.endswith('.png'):
-            output_path = output_path[:-4]
-        barcode = Code128(str(barcode_number), writer=writer)
-        os.makedirs(os.path.dirname(output_path), exist_ok=True)
-        print(f"Barcode object created: {barcode}")
-        saved_path = barcode.save(output_path)
-        if saved_path is None:
-            raise ValueError("ImageWriter barcode save returned None")
-        print(f"Barcode saved successfully to: {saved_path}")
-        return True
+        conn = get_db_connection()
+        student_cache.ensure(conn)
+        today_state.ensure(conn, datetime.now(PH_TIMEZONE).date())
     except Exception as e:
-        print(f"ImageWriter failed: {str(e)} - Type: {type(e)} - Full Stacktrace:\n{traceback.format_exc()}")
-        try:
-            print(f"Attempting fallback with SVGWriter for {barcode_number}")
-            writer = SVGWriter()
-            print(f"SVGWriter object: {writer}")
-            svg_path = f"{output_path}.svg"
-            barcode = Code128(str(barcode_number), writer=writer)
-            os.makedirs(os.path.dirname(svg_path), exist_ok=True)
-            print(f"Barcode object created with SVGWriter: {barcode}")
-            barcode.save(svg_path)
-            print(f"SVG barcode saved to: {svg_path}")
-            png_path = f"{output_path}.png"
-            cairosvg.svg2png(url=svg_path, write_to=png_path)
-            print(f"PNG barcode saved to: {png_path}")
-            return True
-        except Exception as e:
-            print(f"SVGWriter failed: {str(e)} - Type: {type(e)} - Full Stacktrace:\n{traceback.format_exc()}")
-            return False
-
-def generate_word_document(dataframe, output_path, barcode_paths):
-    print(f"Generating Word document with DataFrame:\n{dataframe}")
-    print(f"Barcode paths: {barcode_paths}")
-    doc = Document()
-    section = doc.sections[0]
-    section.page_height = Inches(11)
-    section.page_width = Inches(8.5)
-    section.top_margin = Inches(0.5)
-    section.bottom_margin = Inches(0.5)
-    section.left_margin = Inches(0.7)
-    section.right_margin = Inches(0.7)
-
-    for index, row in dataframe.iterrows():
-        name = row.get("Name", "Unknown")
-        barcode_number = row.get("Barcode", "")
-        print(f"Processing row {index}: Name={name}, Barcode={barcode_number}")
-
-        if not name:
-            print("Skipping row: No name")
-            continue
-
-        paragraph = doc.add_paragraph()
-        paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-
-        run = paragraph.add_run(f"{name}\n")
-        run.bold = True
-        run.font.size = Pt(14)
-        print(f"Added name: {name} to document")
-
-        barcode_path = barcode_paths.get(barcode_number, "")
-        print(f"Checking barcode path: {barcode_path}")
-        if barcode_path and os.path.exists(barcode_path):
-            try:
-                run_img = paragraph.add_run()
-                run_img.add_picture(barcode_path, width=Inches(1.5), height=Inches(0.75))
-                print(f"Added barcode image from {barcode_path}")
-            except Exception as e:
-                error_p = doc.add_paragraph(f"[ERROR: Could not add barcode image: {str(e)}]")
-                error_p.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
-                print(f"Error adding barcode image for {name}: {str(e)}")
-        else:
-            print(f"No barcode image found at {barcode_path} for {name}, skipping barcode")
-
-    try:
-        print(f"Saving Word document to: {output_path}")
-        doc.save(output_path)
-        if os.path.exists(output_path):
-            print(f"Document saved, size: {os.path.getsize(output_path)} bytes")
+        print(f"Could not preload student cache and today's attendance, will load on first scan: {str(e)}")
+    finally:
+        if conn is not None:
+            conn.close()
+    today_state.schedule_rollover(get_db_connection, PH_TIMEZONE)
+
+@metrics.stage_latency.time("render_barcodes")
+def render_roster_barcodes(barcode_numbers, progress=None):
+    return barcode_render.render_barcodes(barcode_numbers, progress)
+
+@metrics.stage_latency.time("generate_word_document")
+def generate_word_document(students, barcode_images, layout=LABEL_LAYOUT):
+    # The document is built in memory
+    students = list(students)
+    print(f"Generating Word document for {len(students)} students")
+    doc = LabelDocument(layout)
+    doc.add(students, barcode_images)
+    return doc.save()
+
+def format_time(value):
+    if not value:
+        return "N/A"
+    if isinstance(value, timedelta):
+        hour, minute = divmod(int(value.total_seconds()) // 60 % 1440, 60)
+        return f"{hour % 12 or 12:02d}:{minute:02d} {'AM' if hour < 12 else 'PM'}"
+    return datetime.strptime(str(value), "%H:%M:%S").strftime("%I:%M %p")
+
+def record_scan(cursor, student_id, ph_time):
+    # Time-in/time-out transition in one round trip; see database/migrations/001
+    cursor.callproc("record_scan", (student_id, ph_time.date(), ph_time.strftime('%H:%M:%S')))
+    for result in cursor.stored_results():
+        row = result.fetchone()
+        if row:
+            return row
+    raise ValueError(f"No attendance row recorded for student {student_id}")
+
+def scan_response(student_name, department, status, time_in, time_out, ph_time):
+    if status == "Time In":
+        message = f"Time In recorded for {student_name}"
+    elif status == "Time Out":
+        message = f"Time Out recorded for {student_name}"
+    elif status == "Duplicate":
+        message = f"Scan already recorded for {student_name}"
+    else:
+        return {
+            "success": False,
+            "message": "Already Timed Out for Today",
+            "name": student_name,
+            "department": department,
+            "time_in": format_time(time_in),
+            "time_out": format_time(time_out),
+            "status": status,
+            "date": "Today"
+        }
+    return {
+        "success": True,
+        "message": message,
+        "name": student_name,
+        "department": department,
+        "time_in": format_time(time_in),
+        "time_out": format_time(time_out),
+        "status": status,
+        "date": ph_time.strftime("%Y-%m-%d")
+    }
+
+def parse_scan_time(value):
+    if not value:
+        return datetime.now(PH_TIMEZONE)
+    scanned_at = datetime.fromisoformat(str(value).replace("Z", "+00:00"))
+    if scanned_at.tzinfo is None:
+        return PH_TIMEZONE.localize(scanned_at)
+    return scanned_at.astimezone(PH_TIMEZONE)
+
+def time_seconds(value):
+    # TIME columns come back as timedelta; times decided in this batch are "HH:MM:SS"
+    if isinstance(value, timedelta):
+        return int(value.total_seconds())
+    hour, minute, second = map(int, str(value).split(":"))
+    return hour * 3600 + minute * 60 + second
+
+def apply_scan_batch(conn, events):
+    # events: list of (index, student_id, ph_time, kiosk_id), applied in scan-time order.
+    # Batches are resent when a response is lost, so an event at or before the
+    # recorded time-in (or time-out), or an exact repeat of an earlier event,
+    # is a "Duplicate" and writes nothing.
+    cursor = conn.cursor()
+    keys = {(student_id, ph_time.date()) for _, student_id, ph_time, _ in events}
+    state = {}
+    if keys:
+        student_ids = sorted({key[0] for key in keys})
+        dates = sorted({key[1] for key in keys})
+        cursor.execute(
+            f"""SELECT id, student_id, date, time_in, time_out FROM attendance
+                WHERE student_id IN ({", ".join(["%s"] * len(student_ids))})
+                AND date IN ({", ".join(["%s"] * len(dates))}) FOR UPDATE""",
+            tuple(student_ids) + tuple(dates))
+        for attendance_id, student_id, date, time_in, time_out in cursor.fetchall():
+            state[(student_id, date)] = {"id": attendance_id, "time_in": time_in, "time_out": time_out}
+
+    inserts = {}
+    updates = {}
+    outcomes = {}
+    seen = set()
+    for index, student_id, ph_time, kiosk_id in sorted(events, key=lambda event: (event[2], event[0])):
+        key = (student_id, ph_time.date())
+        time_str = ph_time.strftime('%H:%M:%S')
+        record = state.get(key)
+        repeat = (student_id, ph_time, kiosk_id) in seen
+        seen.add((student_id, ph_time, kiosk_id))
+        if record is None:
+            record = state[key] = {"id": None, "time_in": time_str, "time_out": None}
+            inserts[key] = record
+            status = "Time In"
+        elif (repeat or time_seconds(time_str) <= time_seconds(record["time_in"])
+              or (record["time_out"] and time_seconds(time_str) <= time_seconds(record["time_out"]))):
+            status = "Duplicate"
+        elif not record["time_out"]:
+            record["time_out"] = time_str
+            if record["id"] is not None:
+                updates[record["id"]] = time_str
+            status = "Time Out"
         else:
-            print("Error: Document not saved")
-    except Exception as e:
-        print(f"Error saving Word document: {str(e)}")
-
-def generate_unique_barcode(cursor):
-    while True:
-        barcode = ''.join(random.choices(string.digits, k=12))
-        cursor.execute("SELECT COUNT(*) FROM students WHERE barcode = %s", (barcode,))
-        if cursor.fetchone()[0] == 0:
-            return barcode
-
-def cleanup_files(excel_path, docx_path, barcode_paths):
-    print(f"Cleaning up files: {excel_path}, {docx_path}, {barcode_paths}")
+            status = "Already Timed Out"
+        outcomes[index] = (status, record["time_in"], record["time_out"])
+
+    if inserts:
+        cursor.executemany(
+            "INSERT INTO attendance (student_id, date, time_in, time_out) VALUES (%s, %s, %s, %s)",
+            [(key[0], key[1], record["time_in"], record["time_out"]) for key, record in inserts.items()])
+    if updates:
+        cursor.executemany(
+            "UPDATE attendance SET time_out = %s WHERE id = %s AND time_out IS NULL",
+            [(time_out, attendance_id) for attendance_id, time_out in updates.items()])
+    cursor.close()
+    return outcomes
+
+def attendance_filters(batch, position, department, school, date):
+    query = ""
+    filters = []
+    if batch:
+        query += " AND s.batch = %s"
+        filters.append(batch)
+    if position:
+        query += " AND s.position = %s"
+        filters.append(position)
+    if department:
+        query += " AND s.department = %s"
+        filters.append(department)
+    if school:
+        query += " AND s.school = %s"
+        filters.append(school)
+    if date:
+        query += " AND a.date = %s"
+        filters.append(date)
+    return query, filters
+
+def encode_attendance_cursor(date, attendance_id):
+    raw = json.dumps([str(date), attendance_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_attendance_cursor(token):
     try:
-        if excel_path and os.path.exists(excel_path):
-            os.remove(excel_path)
-        if docx_path and os.path.exists(docx_path):
-            os.remove(docx_path)
-        for barcode_path in barcode_paths.values():
-            if barcode_path and os.path.exists(barcode_path):
-                os.remove(barcode_path)
-            svg_path = barcode_path.replace('.png', '.svg')
-            if os.path.exists(svg_path):
-                os.remove(svg_path)
-    except Exception as e:
-        print(f"Error during cleanup: {str(e)}")
-
-def format_excel_time(worksheet):
-    time_style = NamedStyle(name='time_style', number_format='HH:MM:SS')
-    headers = [cell.value for cell in worksheet[1]]
-    time_in_col = headers.index('Time In') + 1 if 'Time In' in headers else None
-    time_out_col = headers.index('Time Out') + 1 if 'Time Out' in headers else None
-
-    if time_in_col:
-        for cell in worksheet[get_column_letter(time_in_col)][1:]:
-            cell.style = time_style
-    if time_out_col:
-        for cell in worksheet[get_column_letter(time_out_col)][1:]:
-            cell.style = time_style
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        date, attendance_id = json.loads(raw)
+        return datetime.strptime(date, "%Y-%m-%d").date(), int(attendance_id)
+    except Exception:
+        raise ValueError("Invalid cursor")
 
 # Routes
 @app.route("/login", methods=["POST"])
@@ -162,11 +308,17 @@ def login():
     username = data.get("username")
     password = data.get("password")
 
-    db = get_db_connection()
-    cursor = db.cursor(dictionary=True)
-    cursor.execute("SELECT * FROM users WHERE username = %s AND password = %s", (username, password))
-    user = cursor.fetchone()
-    db.close()
+    db = None
+    try:
+        db = get_db_connection()
+        cursor = db.cursor(dictionary=True)
+        cursor.execute("SELECT * FROM users WHERE username = %s AND password = %s", (username, password))
+        user = cursor.fetchone()
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if db is not None:
+            db.close()
 
     if user:
         session["user"] = username
@@ -174,6 +326,124 @@ def login():
         return jsonify({"message": "Login successful"}), 200
     return jsonify({"error": "Invalid credentials"}), 401
 
+def process_roster(job, path, label_format="docx", group_by=None, match_on=None):
+    # match_on (a list of roster columns) turns the upload into an upsert
+    db = None
+    inserted_count = 0
+    updated_count = 0
+    unchanged_count = 0
+    try:
+        # Two passes over the spooled file, a chunk at a time: validate
+        # everything first, then write. Nothing holds the whole roster.
+        job.update("validating", 0)
+        print(f"Reading Excel upload ({os.path.getsize(path)} bytes)")
+        db = get_db_connection()
+        total, errors = validate_roster(db, path, match_on)
+        if errors:
+            job.report = {"errors": errors}
+            raise ValueError(f"Roster has {len(errors)} problem(s); nothing was saved")
+        total = max(total, 1)
+
+        if group_by:
+            # Grouped documents are built in parallel when the result is downloaded
+            doc = None
+            groups = {}
+        else:
+            doc = LabelPDF() if label_format == "pdf" else LabelDocument()
+        failures = []
+        seen = 0
+
+        for frame in roster_frames(path):
+            base = 5 + 80 * seen / total
+            step = 80 * len(frame) / total
+            seen += len(frame)
+
+            if match_on:
+                rows = frame
+                frame, changes, unchanged, diff_errors = diff_roster(db, frame, match_on)
+                unchanged_count += unchanged
+                # Validated already, so these are students changed since by another writer
+                for error in diff_errors:
+                    name, barcode = rows.loc[error["row"], "Name"], rows.loc[error["row"], "Barcode"]
+                    print(f"Skipped row {error['row']} ({name}, {barcode}): {error['error']}")
+                    failures.append({"row": error["row"], "name": name, "barcode": barcode, "error": error["error"]})
+                frame = frame.loc[~frame.index.isin([error["row"] for error in diff_errors])]
+                if changes:
+                    job.update("updating students", base)
+                    update_students(db, changes)
+                    db.commit()
+                    updated_count += len(changes)
+                    today_state.forget_details(student_id for student_id, _ in changes)
+            chunk = frame_rows(frame)
+
+            missing = [idx for idx, (_, values) in enumerate(chunk) if not values[5]]
+            if missing:
+                job.update("allocating barcodes", base)
+                codes = barcode_allocator.reserve(db, len(missing))
+                for idx, code in zip(missing, codes):
+                    row_number, values = chunk[idx]
+                    chunk[idx] = (row_number, values[:5] + (code,))
+                print(f"Allocated {len(missing)} barcodes")
+
+            job.update("saving students", base)
+            inserted, chunk_failures = insert_students(db, chunk)
+            # reserve() commits on this connection anyway; committing each chunk
+            # keeps the transaction as small as the chunk
+            db.commit()
+            inserted_count += len(inserted)
+            for failure in chunk_failures:
+                print(f"Skipped row {failure['row']} ({failure['name']}, {failure['barcode']}): {failure['error']}")
+            failures.extend(chunk_failures)
+
+            inserted = set(inserted)
+            if group_by:
+                for row_number, values in chunk:
+                    if row_number in inserted:
+                        groups.setdefault(values[GROUP_COLUMNS[group_by]], []).append((values[0], values[5]))
+                continue
+            students = [(values[0], values[5]) for row_number, values in chunk if row_number in inserted]
+            barcode_images = {}
+            if label_format == "docx":
+                job.update("rendering barcodes", base + step / 4)
+                barcode_numbers = [barcode for _, barcode in students]
+                images = render_roster_barcodes(
+                    barcode_numbers,
+                    progress=lambda done, count: job.update("rendering barcodes", base + step / 4 + step / 2 * done / count))
+                for barcode_number, image in zip(barcode_numbers, images):
+                    if image is None:
+                        print(f"Failed to generate barcode for {barcode_number}")
+                    else:
+                        barcode_images[barcode_number] = image
+            doc.add(students, barcode_images)
+
+        print(f"Saved {inserted_count} students, updated {updated_count}, unchanged {unchanged_count}, "
+              f"skipped {len(failures)} rows")
+        job.report = {"inserted": inserted_count, "updated": updated_count,
+                      "unchanged": unchanged_count, "failed": failures}
+        if group_by:
+            return (lambda: stream_group_labels(groups, label_format), "student_barcodes.zip", "application/zip")
+        job.update("building document", 85)
+        file_data = doc.save().getvalue()
+        return (file_data, f"student_barcodes.{label_format}", LABEL_MIMETYPES[label_format])
+
+    except Exception as e:
+        print(f"Error in upload_file: {str(e)}")
+        if db is not None:
+            db.rollback()
+        raise
+    finally:
+        if inserted_count or updated_count:
+            # Reload here, off the request path, so scans never pay for it
+            try:
+                student_cache.preload(db)
+            except Exception as e:
+                print(f"Student cache refresh failed, will reload on next scan: {str(e)}")
+                student_cache.invalidate()
+            invalidate_filters()
+        if db is not None:
+            db.close()
+        os.remove(path)
+
 @app.route("/upload", methods=["POST"])
 def upload_file():
     if 'file' not in request.files:
@@ -181,72 +451,56 @@ def upload_file():
     file = request.files['file']
     if file.filename == '':
         return jsonify({"error": "No selected file"}), 400
+    label_format = request.args.get("format", "docx")
+    if label_format not in LABEL_MIMETYPES:
+        return jsonify({"error": f"Unsupported format, use one of: {', '.join(LABEL_MIMETYPES)}"}), 400
+    group_by = request.args.get("group_by")
+    if group_by and group_by not in GROUP_COLUMNS:
+        return jsonify({"error": f"Unsupported group_by, use one of: {', '.join(GROUP_COLUMNS)}"}), 400
+    match_on = None
+    if request.args.get("mode", "insert") == "upsert":
+        match_on = request.args.get("match_on")
+        match_on = [col.strip() for col in match_on.split(",")] if match_on else ROSTER_MATCH_ON
+        if not all(col in STUDENT_COLUMNS for col in match_on):
+            return jsonify({"error": f"match_on must be columns from: {', '.join(STUDENT_COLUMNS)}"}), 400
     if file and file.filename.endswith('.xlsx'):
-        try:
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx')
-            file.save(temp_file.name)
-            print(f"Reading Excel file: {temp_file.name}")
-            df = pd.read_excel(temp_file.name, engine="openpyxl")
-            print(f"DataFrame after reading:\n{df}")
-            df.dropna(how="all", inplace=True)
-            df.fillna("", inplace=True)
-            print(f"DataFrame after cleaning:\n{df}")
-
-            required_columns = ["Name", "Batch", "Position", "Department", "School"]
-            if not all(col in df.columns for col in required_columns):
-                raise ValueError("Missing required columns")
-
-            db = get_db_connection()
-            cursor = db.cursor()
-
-            if "Barcode" not in df.columns:
-                print("Generating barcodes...")
-                df["Barcode"] = df.apply(lambda _: generate_unique_barcode(cursor), axis=1)
-                print(f"DataFrame with barcodes:\n{df}")
-
-            barcode_paths = {}
-            for _, row in df.iterrows():
-                barcode_number = row["Barcode"]
-                print(f"Generating barcode for {barcode_number}")
-                base_path = os.path.join(tempfile.gettempdir(), f"barcode_{barcode_number}")
-                barcode_path = f"{base_path}.png"
-                if generate_barcode_image(barcode_number, base_path):
-                    barcode_paths[barcode_number] = barcode_path
-                    print(f"Barcode image saved to: {barcode_path}")
-                else:
-                    print(f"Failed to generate barcode for {barcode_number}")
-
-            for _, row in df.iterrows():
-                print(f"Inserting student: {row['Name']} with barcode {row['Barcode']}")
-                cursor.execute(
-                    "INSERT INTO students (Name, Batch, Position, Department, School, Barcode) VALUES (%s, %s, %s, %s, %s, %s)",
-                    (row["Name"], row["Batch"], row["Position"], row["Department"], row["School"], row["Barcode"])
-                )
-
-            db.commit()
-            output_docx = os.path.join(tempfile.gettempdir(), "student_barcodes.docx")
-            print(f"Generating Word document at: {output_docx}")
-            generate_word_document(df, output_docx, barcode_paths)
-
-            with open(output_docx, 'rb') as f:
-                file_data = io.BytesIO(f.read())
-
-            cleanup_files(temp_file.name, output_docx, barcode_paths)
-            file_data.seek(0)
-            return send_file(
-                file_data,
-                as_attachment=True,
-                download_name="student_barcodes.docx",
-                mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
-            )
-
-        except Exception as e:
-            print(f"Error in upload_file: {str(e)}")
-            cleanup_files(temp_file.name if 'temp_file' in locals() else None, None, {})
-            return jsonify({"error": str(e)}), 500
+        # Spool to disk rather than memory: the job outlives the request, and
+        # holding every queued upload's bytes would tie memory to file size
+        fd, path = tempfile.mkstemp(suffix=".xlsx")
+        with os.fdopen(fd, "wb") as f:
+            file.save(f)
+        job = upload_jobs.submit(file.filename, process_roster, path, label_format, group_by, match_on)
+        return jsonify({
+            "job_id": job.id,
+            "status_url": f"/upload/{job.id}",
+            "result_url": f"/upload/{job.id}/result"
+        }), 202
     else:
         return jsonify({"error": "File must be an Excel (.xlsx) file"}), 400
 
+@app.route("/upload/<job_id>", methods=["GET"])
+def upload_status(job_id):
+    job = upload_jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "Unknown upload job (expired, or handled by another backend process)"}), 404
+    return jsonify(job.to_dict())
+
+@app.route("/upload/<job_id>/result", methods=["GET"])
+def upload_result(job_id):
+    job = upload_jobs.get(job_id)
+    if not job:
+        return jsonify({"error": "Unknown upload job (expired, or handled by another backend process)"}), 404
+    if job.status == "failed":
+        return jsonify({"error": job.error}), 500
+    if job.status != "done":
+        return jsonify(job.to_dict()), 409
+    data, filename, mimetype = job.result
+    if callable(data):
+        response = Response(data(), mimetype=mimetype)
+        response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+        return response
+    return send_file(io.BytesIO(data), as_attachment=True, download_name=filename, mimetype=mimetype)
+
 @app.route("/add_student", methods=["POST"])
 def add_student():
     if "user" not in session:
@@ -256,6 +510,9 @@ def add_student():
     required_fields = ["name", "batch", "position", "department", "school"]
     if not all(data.get(field) for field in required_fields):
         return jsonify({"error": "Missing required fields"}), 400
+    label_format = request.args.get("format", "docx")
+    if label_format not in LABEL_MIMETYPES:
+        return jsonify({"error": f"Unsupported format, use one of: {', '.join(LABEL_MIMETYPES)}"}), 400
 
     df = pd.DataFrame([{
         'Name': data["name"].strip(),
@@ -268,15 +525,13 @@ def add_student():
     try:
         db = get_db_connection()
         cursor = db.cursor()
-        barcode = generate_unique_barcode(cursor)
+        barcode = barcode_allocator.reserve(db, 1)[0]
         df["Barcode"] = barcode
 
-        base_path = os.path.join(tempfile.gettempdir(), f"barcode_{barcode}")
-        barcode_path = f"{base_path}.png"
-        if generate_barcode_image(barcode, base_path):
-            barcode_paths = {barcode: barcode_path}
-        else:
-            raise Exception("Failed to generate barcode")
+        if label_format == "docx":
+            image = render_roster_barcodes([barcode])[0]
+            if image is None:
+                raise Exception("Failed to generate barcode")
 
         cursor.execute(
             "INSERT INTO students (Name, Batch, Position, Department, School, Barcode) VALUES (%s, %s, %s, %s, %s, %s)",
@@ -285,25 +540,28 @@ def add_student():
         )
 
         db.commit()
-        output_docx = os.path.join(tempfile.gettempdir(), f"student_barcode_{barcode}.docx")
-        generate_word_document(df, output_docx, barcode_paths)
-
-        with open(output_docx, 'rb') as f:
-            file_data = io.BytesIO(f.read())
-
-        cleanup_files(None, output_docx, barcode_paths)
-        file_data.seek(0)
+        student_cache.put(barcode, (cursor.lastrowid, df.iloc[0]["Name"], df.iloc[0]["Department"]))
+        invalidate_filters()
+        if label_format == "pdf":
+            label_pdf = LabelPDF()
+            label_pdf.add([(df.iloc[0]["Name"], barcode)])
+            file_data = label_pdf.save()
+        else:
+            file_data = generate_word_document([(df.iloc[0]["Name"], barcode)], {barcode: image}, layout="list")
         return send_file(
             file_data,
             as_attachment=True,
-            download_name=f"student_barcode_{data['name']}.docx",
-            mimetype='application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+            download_name=f"student_barcode_{data['name']}.{label_format}",
+            mimetype=LABEL_MIMETYPES[label_format]
         )
 
     except Exception as e:
-        db.rollback()
-        cleanup_files(None, None, barcode_paths)
+        if 'db' in locals():
+            db.rollback()
         return jsonify({"error": str(e)}), 500
+    finally:
+        if 'db' in locals():
+            db.close()
 
 @app.route("/logout", methods=["POST"])
 def logout():
@@ -318,168 +576,200 @@ def process_scan():
     if not barcode:
         return jsonify({"success": False, "message": "No barcode received"}), 400
 
+    if attendance_writer:
+        return process_scan_write_behind(barcode.strip())
+
+    conn = None
     try:
         conn = get_db_connection()
         cursor = conn.cursor()
-        cursor.execute("SELECT id, name, department FROM students WHERE barcode = %s", (barcode.strip(),))
-        student = cursor.fetchone()
+        student = student_cache.lookup(conn, barcode.strip())
 
         if not student:
             return jsonify({"success": False, "message": "Student not found"}), 404
 
         student_id, student_name, department = student
-        cursor.execute(
-            "SELECT id, time_in, time_out FROM attendance WHERE student_id = %s AND date = CURDATE()",
-            (student_id,))
-        record = cursor.fetchone()
 
         # Get current time in Philippine timezone
         ph_time = datetime.now(PH_TIMEZONE)
-        ph_time_str = ph_time.strftime('%H:%M:%S')  # For database
-        ph_time_formatted = ph_time.strftime("%I:%M %p")  # For JSON response
-
-        if record:
-            attendance_id, time_in, time_out = record
-            if time_in and not time_out:
-                cursor.execute(
-                    "UPDATE attendance SET time_out = %s, date = CURDATE() WHERE id = %s",
-                    (ph_time_str, attendance_id))
-                conn.commit()
-                time_in_formatted = datetime.strptime(str(time_in), "%H:%M:%S").strftime("%I:%M %p") if time_in else "N/A"
-                return jsonify({
-                    "success": True,
-                    "message": f"Time Out recorded for {student_name}",
-                    "name": student_name,
-                    "department": department,
-                    "time_in": time_in_formatted,
-                    "time_out": ph_time_formatted,
-                    "status": "Time Out",
-                    "date": ph_time.strftime("%Y-%m-%d")
-                })
-            time_in_formatted = datetime.strptime(str(time_in), "%H:%M:%S").strftime("%I:%M %p") if time_in else "N/A"
-            time_out_formatted = datetime.strptime(str(time_out), "%H:%M:%S").strftime("%I:%M %p") if time_out else "N/A"
-            return jsonify({
-                "success": False,
-                "message": "Already Timed Out for Today",
-                "name": student_name,
-                "department": department,
-                "time_in": time_in_formatted,
-                "time_out": time_out_formatted,
-                "status": "Already Timed Out",
-                "date": "Today"
-            })
-        else:
-            cursor.execute(
-                "INSERT INTO attendance (student_id, date, time_in) VALUES (%s, CURDATE(), %s)",
-                (student_id, ph_time_str))
-            conn.commit()
-            return jsonify({
-                "success": True,
-                "message": f"Time In recorded for {student_name}",
-                "name": student_name,
-                "department": department,
-                "time_in": ph_time_formatted,
-                "time_out": "N/A",
-                "status": "Time In",
-                "date": ph_time.strftime("%Y-%m-%d")
-            })
+        today_state.ensure(conn, ph_time.date())
+        current = today_state.get(student_id, ph_time.date())
+        if current and current[2]:
+            return jsonify(scan_response(student_name, department, "Already Timed Out", current[1], current[2], ph_time))
+
+        attendance_id, time_in, time_out, status = record_scan(cursor, student_id, ph_time)
+        conn.commit()
+        today_state.set(student_id, ph_time.date(), time_in, time_out, attendance_id)
+        return jsonify(scan_response(student_name, department, status, time_in, time_out, ph_time))
 
     except Exception as e:
         return jsonify({"success": False, "message": str(e)}), 500
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
 
-@app.route('/attendance', methods=['GET'])
-def get_attendance():
+def process_scan_write_behind(barcode):
+    conn = None
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor(dictionary=True)
-
-        batch = request.args.get('batch')
-        position = request.args.get('position')
-        department = request.args.get('department')
-        school = request.args.get('school')
-        date = request.args.get('date')
-
-        query = """
-            SELECT s.name, s.batch, s.position, s.department, s.school,
-                   a.date, a.time_in, a.time_out
-            FROM attendance a
-            JOIN students s ON a.student_id = s.id
-            WHERE 1=1
-        """
-        filters = []
-
-        if batch:
-            query += " AND s.batch = %s"
-            filters.append(batch)
-        if position:
-            query += " AND s.position = %s"
-            filters.append(position)
-        if department:
-            query += " AND s.department = %s"
-            filters.append(department)
-        if school:
-            query += " AND s.school = %s"
-            filters.append(school)
-        if date:
-            query += " AND a.date = %s"
-            filters.append(date)
-
-        query += " ORDER BY a.date DESC"
-
-        cursor.execute(query, tuple(filters))
-        records = cursor.fetchall()
+        ph_time = datetime.now(PH_TIMEZONE)
+        student = student_cache.get(barcode)
+        if student is None or not today_state.is_loaded(ph_time.date()):
+            conn = get_db_connection()
+            if student is None:
+                student = student_cache.lookup(conn, barcode)
+            today_state.ensure(conn, ph_time.date())
 
-        for record in records:
-            if record["time_in"]:
-                record["time_in"] = datetime.strptime(str(record["time_in"]), "%H:%M:%S").strftime("%I:%M %p")
-            else:
-                record["time_in"] = "N/A"
-            if record["time_out"]:
-                record["time_out"] = datetime.strptime(str(record["time_out"]), "%H:%M:%S").strftime("%I:%M %p")
-            else:
-                record["time_out"] = "N/A"
+        if not student:
+            return jsonify({"success": False, "message": "Student not found"}), 404
 
-        return jsonify(records)
+        student_id, student_name, department = student
+        status, time_in, time_out = today_state.scan(
+            student_id, ph_time.date(), ph_time.strftime('%H:%M:%S'), on_change=attendance_writer.submit)
+        return jsonify(scan_response(student_name, department, status, time_in, time_out, ph_time))
 
+    except WriterBusy as e:
+        return jsonify({"success": False, "message": str(e)}), 503
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        return jsonify({"success": False, "message": str(e)}), 500
     finally:
-        conn.close()
+        if conn is not None:
+            conn.close()
+
+@app.route('/scan/batch', methods=['POST'])
+def process_scan_batch():
+    data = request.get_json(silent=True)
+    events = data.get("events") if isinstance(data, dict) else data
+    if not isinstance(events, list) or not events:
+        return jsonify({"success": False, "message": "No scan events received"}), 400
+    if len(events) > SCAN_BATCH_MAX:
+        return jsonify({"success": False, "message": f"At most {SCAN_BATCH_MAX} events per batch"}), 413
+
+    results = [None] * len(events)
+    parsed = []
+    for index, event in enumerate(events):
+        event = event if isinstance(event, dict) else {}
+        barcode = str(event.get("barcode") or "").strip()
+        result = {"index": index, "barcode": barcode, "kiosk_id": event.get("kiosk_id")}
+        results[index] = result
+        if not barcode:
+            result.update({"success": False, "message": "No barcode received"})
+            continue
+        try:
+            ph_time = parse_scan_time(event.get("timestamp"))
+        except ValueError:
+            result.update({"success": False, "message": "Invalid timestamp"})
+            continue
+        parsed.append((index, barcode, ph_time, event.get("kiosk_id")))
 
-@app.route('/filters', methods=['GET'])
-def get_filters():
     try:
-        db = get_db_connection()
-        cursor = db.cursor(dictionary=True)
-
-        cursor.execute("SELECT DISTINCT batch FROM students WHERE batch IS NOT NULL")
-        batches = [row["batch"] for row in cursor.fetchall()]
-
-        cursor.execute("SELECT DISTINCT position FROM students WHERE position IS NOT NULL")
-        positions = [row["position"] for row in cursor.fetchall()]
-
-        cursor.execute("SELECT DISTINCT department FROM students WHERE department IS NOT NULL")
-        departments = [row["department"] for row in cursor.fetchall()]
+        if attendance_writer:
+            # Queued scans must be in the table before the batch reads it
+            attendance_writer.drain()
+        conn = get_db_connection()
+        students = student_cache.lookup_many(conn, [barcode for _, barcode, _, _ in parsed])
 
-        cursor.execute("SELECT DISTINCT school FROM students WHERE school IS NOT NULL")
-        schools = [row["school"] for row in cursor.fetchall()]
+        scans = []
+        for index, barcode, ph_time, kiosk_id in parsed:
+            if barcode in students:
+                scans.append((index, students[barcode][0], ph_time, kiosk_id))
+            else:
+                results[index].update({"success": False, "message": "Student not found"})
+
+        outcomes = apply_scan_batch(conn, scans)
+        conn.commit()
+        if outcomes:
+            scan_keys = {index: (student_id, ph_time.date()) for index, student_id, ph_time, _ in scans}
+            for index, (status, time_in, time_out) in outcomes.items():
+                if status != "Duplicate":
+                    today_state.set(*scan_keys[index], time_in, time_out)
+
+        for index, barcode, ph_time, _ in parsed:
+            if index in outcomes:
+                status, time_in, time_out = outcomes[index]
+                _, student_name, department = students[barcode]
+                results[index].update(scan_response(student_name, department, status, time_in, time_out, ph_time))
 
         return jsonify({
-            "batches": batches,
-            "positions": positions,
-            "departments": departments,
-            "schools": schools
+            "success": True,
+            "processed": len(outcomes),
+            "results": results
         })
 
+    except WriterBusy as e:
+        return jsonify({"success": False, "message": str(e)}), 503
     except Exception as e:
-        return jsonify({"error": str(e)}), 500
+        if 'conn' in locals():
+            conn.rollback()
+        return jsonify({"success": False, "message": str(e)}), 500
     finally:
-        db.close()
+        if 'conn' in locals():
+            conn.close()
+
+@app.route('/scan/cache', methods=['GET'])
+def scan_cache_stats():
+    return jsonify(student_cache.stats())
+
+@app.route('/scan/writer', methods=['GET'])
+def scan_writer_stats():
+    if not attendance_writer:
+        return jsonify({"enabled": False})
+    return jsonify(attendance_writer.stats())
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+@app.route('/db/pool', methods=['GET'])
+def db_pool_stats():
+    return jsonify(db_pool.stats())
+
+def stream_attendance(filter_sql, filters):
+    query = """
+        SELECT s.name, s.batch, s.position, s.department, s.school,
+               a.date, a.time_in, a.time_out
+        FROM attendance a
+        JOIN students s ON a.student_id = s.id
+        WHERE 1=1
+    """ + filter_sql + " ORDER BY a.date DESC"
+
+    def generate():
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor(dictionary=True, buffered=False)
+            cursor.execute(query, tuple(filters))
+            yield "["
+            first = True
+            while True:
+                rows = cursor.fetchmany(ATTENDANCE_STREAM_CHUNK)
+                if not rows:
+                    break
+                for row in rows:
+                    row["time_in"] = format_time(row["time_in"])
+                    row["time_out"] = format_time(row["time_out"])
+                chunk = app.json.dumps(rows)[1:-1]
+                yield chunk if first else "," + chunk
+                first = False
+            yield "]"
+            cursor.close()
+        except Exception as e:
+            # Headers are already sent; truncating the array signals the failure
+            print(f"Error streaming attendance: {str(e)}")
+        finally:
+            conn.close()
 
-@app.route('/attendance/download', methods=['GET'])
-def download_attendance():
+    return Response(generate(), mimetype="application/json")
+
+@app.route('/attendance', methods=['GET'])
+def get_attendance():
+    if request.args.get('stream') in ("1", "true"):
+        date = request.args.get('date')
+        if date == "today":
+            date = datetime.now(PH_TIMEZONE).date().isoformat()
+        return stream_attendance(*attendance_filters(
+            request.args.get('batch'), request.args.get('position'),
+            request.args.get('department'), request.args.get('school'), date))
+
+    conn = None
     try:
         conn = get_db_connection()
         cursor = conn.cursor(dictionary=True)
@@ -490,88 +780,323 @@ def download_attendance():
         school = request.args.get('school')
         date = request.args.get('date')
 
+        limit = request.args.get('limit')
+        after = request.args.get('after')
+
+        today = datetime.now(PH_TIMEZONE).date()
+        if date in ("today", today.isoformat()):
+            records = None
+            if BACKEND_SINGLE_PROCESS and limit is None and after is None:
+                today_state.ensure(conn, today)
+                records = today_state.records(conn, today)
+            if records is not None:
+                facets = {"batch": batch, "position": position, "department": department, "school": school}
+                records = [record for record in records
+                           if all(record[key] == value for key, value in facets.items() if value)]
+                for record in records:
+                    record["time_in"] = format_time(record["time_in"])
+                    record["time_out"] = format_time(record["time_out"])
+                return jsonify(records)
+            date = today.isoformat()
+
+        filter_sql, filters = attendance_filters(batch, position, department, school, date)
+        if limit is None and after is None:
+            query = """
+                SELECT s.name, s.batch, s.position, s.department, s.school,
+                       a.date, a.time_in, a.time_out
+                FROM attendance a
+                JOIN students s ON a.student_id = s.id
+                WHERE 1=1
+            """ + filter_sql + " ORDER BY a.date DESC"
+
+            cursor.execute(query, tuple(filters))
+            records = cursor.fetchall()
+
+            for record in records:
+                record["time_in"] = format_time(record["time_in"])
+                record["time_out"] = format_time(record["time_out"])
+
+            return jsonify(records)
+
+        # Keyset pagination on (date, id), newest first
+        try:
+            limit = max(1, min(int(limit or ATTENDANCE_PAGE_SIZE), ATTENDANCE_PAGE_MAX))
+            cursor_date, cursor_id = decode_attendance_cursor(after) if after else (None, None)
+        except ValueError:
+            return jsonify({"error": "Invalid limit or cursor"}), 400
+
         query = """
-            SELECT
-                s.name as 'Name',
-                s.batch as 'Batch',
-                s.position as 'Position',
-                s.department as 'Department',
-                s.school as 'School',
-                a.date as 'Date',
-                a.time_in as 'Time In',
-                a.time_out as 'Time Out'
+            SELECT a.id, s.name, s.batch, s.position, s.department, s.school,
+                   a.date, a.time_in, a.time_out
             FROM attendance a
             JOIN students s ON a.student_id = s.id
             WHERE 1=1
-        """
-        filters = []
-
-        if batch:
-            query += " AND s.batch = %s"
-            filters.append(batch)
-        if position:
-            query += " AND s.position = %s"
-            filters.append(position)
-        if department:
-            query += " AND s.department = %s"
-            filters.append(department)
-        if school:
-            query += " AND s.school = %s"
-            filters.append(school)
-        if date:
-            query += " AND a.date = %s"
-            filters.append(date)
-
-        query += " ORDER BY a.date DESC, s.name ASC"
-
-        cursor.execute(query, tuple(filters))
+        """ + filter_sql
+        params = list(filters)
+        if after:
+            query += " AND (a.date < %s OR (a.date = %s AND a.id < %s))"
+            params.extend([cursor_date, cursor_date, cursor_id])
+        query += " ORDER BY a.date DESC, a.id DESC LIMIT %s"
+        params.append(limit + 1)
+
+        cursor.execute(query, tuple(params))
         records = cursor.fetchall()
+        has_more = len(records) > limit
+        records = records[:limit]
 
-        total_students = len(set(record['Name'] for record in records))
-
+        next_cursor = None
+        if has_more:
+            last = records[-1]
+            next_cursor = encode_attendance_cursor(last["date"], last["id"])
         for record in records:
-            if isinstance(record['Time In'], timedelta):
-                record['Time In'] = str(record['Time In'])
-            elif record['Time In']:
-                record['Time In'] = datetime.strptime(str(record['Time In']), "%H:%M:%S").strftime("%I:%M %p")
-            else:
-                record['Time In'] = "N/A"
-            if isinstance(record['Time Out'], timedelta):
-                record['Time Out'] = str(record['Time Out'])
-            elif record['Time Out']:
-                record['Time Out'] = datetime.strptime(str(record['Time Out']), "%H:%M:%S").strftime("%I:%M %p")
-            else:
-                record['Time Out'] = "N/A"
+            del record["id"]
+            record["time_in"] = format_time(record["time_in"])
+            record["time_out"] = format_time(record["time_out"])
 
-        df = pd.DataFrame(records)
-        output = io.BytesIO()
+        page = {"records": records, "next": next_cursor}
+        if request.args.get('total') in ("1", "true"):
+            cursor.execute(
+                "SELECT COUNT(*) AS total FROM attendance a JOIN students s ON a.student_id = s.id WHERE 1=1" + filter_sql,
+                tuple(filters))
+            page["total"] = cursor.fetchone()["total"]
+        return jsonify(page)
 
-        with pd.ExcelWriter(output, engine='openpyxl') as writer:
-            df.to_excel(writer, sheet_name='Attendance', index=False)
-            worksheet = writer.sheets['Attendance']
-            worksheet.append(["Total Students:", total_students])
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        if conn is not None:
+            conn.close()
+
+def compute_filters(conn):
+    # One grouped pass over the students facet index gives every facet list and count
+    cursor = conn.cursor()
+    cursor.execute("""
+        SELECT batch, position, department, school, COUNT(*)
+        FROM students
+        GROUP BY batch, position, department, school
+    """)
+    facets = {"batches": {}, "positions": {}, "departments": {}, "schools": {}}
+    for batch, position, department, school, count in cursor.fetchall():
+        for key, value in (("batches", batch), ("positions", position),
+                           ("departments", department), ("schools", school)):
+            if value is not None:
+                facets[key][value] = facets[key].get(value, 0) + count
+    cursor.close()
+
+    payload = {key: sorted(values) for key, values in facets.items()}
+    payload["counts"] = facets
+    body = json.dumps(payload, sort_keys=True)
+    return {
+        "payload": payload,
+        "etag": hashlib.sha1(body.encode()).hexdigest(),
+        "last_modified": datetime.now(pytz.utc).replace(microsecond=0),
+        "expires": time.monotonic() + FILTERS_CACHE_TTL
+    }
+
+def invalidate_filters():
+    global filters_cache
+    filters_cache = None
 
-            for idx, col in enumerate(df.columns):
-                max_length = max(df[col].astype(str).apply(len).max(), len(col)) + 2
-                worksheet.column_dimensions[chr(65 + idx)].width = max_length
+@app.route('/filters', methods=['GET'])
+def get_filters():
+    global filters_cache
+    cached = filters_cache
+    if cached is None or time.monotonic() > cached["expires"]:
+        db = None
+        try:
+            db = get_db_connection()
+            fresh = compute_filters(db)
+        except Exception as e:
+            return jsonify({"error": str(e)}), 500
+        finally:
+            if db is not None:
+                db.close()
+        if cached is not None and cached["etag"] == fresh["etag"]:
+            fresh["last_modified"] = cached["last_modified"]
+        cached = filters_cache = fresh
+
+    response = jsonify(cached["payload"])
+    response.set_etag(cached["etag"])
+    response.last_modified = cached["last_modified"]
+    response.cache_control.no_cache = True
+    return response.make_conditional(request)
+
+def attendance_export_query(filter_sql):
+    return """
+        SELECT
+            s.name as 'Name',
+            s.batch as 'Batch',
+            s.position as 'Position',
+            s.department as 'Department',
+            s.school as 'School',
+            a.date as 'Date',
+            a.time_in as 'Time In',
+            a.time_out as 'Time Out'
+        FROM attendance a
+        JOIN students s ON a.student_id = s.id
+        WHERE 1=1
+    """ + filter_sql + " ORDER BY a.date DESC, s.name ASC"
+
+def excel_time(value):
+    if isinstance(value, timedelta):
+        return (datetime.min + value).time()
+    return value
+
+def write_attendance_xlsx(cursor, output):
+    # Write-only workbook: rows go straight to openpyxl's temp sheet file, so
+    # memory stays flat. Widths must be known before the first row, so they
+    # come from a leading sample of EXPORT_WIDTH_SAMPLE rows.
+    columns = [column[0] for column in cursor.description]
+    sample = cursor.fetchmany(EXPORT_WIDTH_SAMPLE)
+
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet("Attendance")
+    widths = [len(column) for column in columns]
+    for row in sample:
+        for idx, value in enumerate(row):
+            widths[idx] = max(widths[idx], len(str(value)) if value is not None else 3)
+    for idx, width in enumerate(widths):
+        worksheet.column_dimensions[get_column_letter(idx + 1)].width = width + 2
+
+    time_columns = {columns.index(name) for name in ("Time In", "Time Out") if name in columns}
+    date_column = columns.index("Date") if "Date" in columns else None
+    name_column = columns.index("Name")
+
+    def to_cells(row):
+        cells = list(row)
+        for idx in time_columns:
+            if cells[idx] is None:
+                cells[idx] = "N/A"
+            else:
+                cell = WriteOnlyCell(worksheet, value=excel_time(cells[idx]))
+                cell.number_format = "HH:MM:SS"
+                cells[idx] = cell
+        if date_column is not None and cells[date_column] is not None:
+            cell = WriteOnlyCell(worksheet, value=cells[date_column])
+            cell.number_format = "YYYY-MM-DD"
+            cells[date_column] = cell
+        return cells
+
+    worksheet.append(columns)
+    names = set()
+    rows = sample
+    while rows:
+        for row in rows:
+            names.add(row[name_column])
+            worksheet.append(to_cells(row))
+        rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+    worksheet.append(["Total Students:", len(names)])
+    workbook.save(output)
+
+def stream_attendance_csv(query, filters):
+    def generate():
+        conn = get_db_connection()
+        try:
+            cursor = conn.cursor(buffered=False)
+            cursor.execute(query, filters)
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow([column[0] for column in cursor.description])
+            while True:
+                rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+                if not rows:
+                    break
+                for row in rows:
+                    writer.writerow(["" if value is None else excel_time(value) for value in row])
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            yield buffer.getvalue()
+            cursor.close()
+        except Exception as e:
+            # Headers are already sent; a truncated file signals the failure
+            print(f"Error streaming attendance CSV: {str(e)}")
+        finally:
+            conn.close()
+
+    return Response(generate(), mimetype="text/csv")
+
+def write_attendance_arrow(cursor, output, file_format):
+    schema = pa.schema([
+        ("Name", pa.string()),
+        ("Batch", pa.string()),
+        ("Position", pa.string()),
+        ("Department", pa.string()),
+        ("School", pa.string()),
+        ("Date", pa.date32()),
+        ("Time In", pa.time32("s")),
+        ("Time Out", pa.time32("s"))
+    ])
+    if file_format == "parquet":
+        writer = pq.ParquetWriter(output, schema)
+    else:
+        writer = pa.ipc.new_file(output, schema)
+    try:
+        while True:
+            rows = cursor.fetchmany(EXPORT_FETCH_SIZE)
+            if not rows:
+                break
+            columns = [list(column) for column in zip(*rows)]
+            for idx in (6, 7):
+                columns[idx] = [excel_time(value) for value in columns[idx]]
+            writer.write_batch(pa.record_batch(columns, schema=schema))
+    finally:
+        writer.close()
 
-            format_excel_time(worksheet)
+@app.route('/attendance/download', methods=['GET'])
+def download_attendance():
+    file_format = request.args.get('format', 'xlsx').lower()
+    if file_format not in EXPORT_FORMATS:
+        return jsonify({"error": f"Unsupported format, use one of: {', '.join(EXPORT_FORMATS)}"}), 400
+    if file_format in ("parquet", "arrow") and pa is None:
+        return jsonify({"error": "pyarrow is not installed on the server"}), 501
+
+    batch = request.args.get('batch')
+    position = request.args.get('position')
+    department = request.args.get('department')
+    school = request.args.get('school')
+    date = request.args.get('date')
+
+    filter_sql, filters = attendance_filters(batch, position, department, school, date)
+    query = attendance_export_query(filter_sql)
+    current_date = datetime.now(PH_TIMEZONE).strftime('%Y%m%d')
+    mimetype, extension = EXPORT_FORMATS[file_format]
+    filename = f"attendance_report_{current_date}.{extension}"
+
+    if file_format == "csv":
+        response = stream_attendance_csv(query, tuple(filters))
+        response.headers["Content-Disposition"] = f"attachment; filename={filename}"
+        return response
+
+    try:
+        conn = get_db_connection()
+        cursor = conn.cursor(buffered=False)
+        cursor.execute(query, tuple(filters))
 
+        output = tempfile.TemporaryFile()
+        if file_format == "xlsx":
+            write_attendance_xlsx(cursor, output)
+        else:
+            write_attendance_arrow(cursor, output, file_format)
         output.seek(0)
-        current_date = datetime.now(PH_TIMEZONE).strftime('%Y%m%d')
-        filename = f"attendance_report_{current_date}.xlsx"
 
         return send_file(
             output,
-            mimetype='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+            mimetype=mimetype,
             as_attachment=True,
             download_name=filename
         )
 
     except Exception as e:
+        if 'output' in locals():
+            output.close()
         return jsonify({"error": str(e)}), 500
     finally:
-        conn.close()
+        if 'conn' in locals():
+            conn.close()
+
+if not IS_RENDER_WORKER:
+    preload_state()
 
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
@@ -0,0 +1,73 @@
+import hashlib
+import hmac
+import os
+import threading
+
+BARCODE_DIGITS = 12
+BARCODE_ALLOCATOR_KEY = os.environ.get("BARCODE_ALLOCATOR_KEY")
+FEISTEL_ROUNDS = 8
+
+_HALF = 10 ** (BARCODE_DIGITS // 2)
+
+
+class BarcodeAllocator:
+    """Hands out unique 12-digit barcodes without probing students per code.
+
+    A counter in barcode_sequence is advanced by N in one statement, and each
+    counter value is sent through a keyed Feistel permutation of the
+    10^12 code space. Distinct counter values always give distinct codes,
+    and without the key the codes are not predictable from one another.
+    The key must never change once codes have been issued: it comes from
+    BARCODE_ALLOCATOR_KEY or, if unset, the secret stored in barcode_sequence.
+    """
+
+    def __init__(self, key=BARCODE_ALLOCATOR_KEY):
+        self._key = key.encode() if key else None
+        self._lock = threading.Lock()
+
+    def _load_key(self, cursor):
+        with self._lock:
+            if self._key is None:
+                cursor.execute("SELECT secret FROM barcode_sequence WHERE id = 1")
+                row = cursor.fetchone()
+                if not row:
+                    raise RuntimeError("barcode_sequence is not initialised; run migrate.py")
+                self._key = row[0].encode()
+            return self._key
+
+    def _round(self, key, round_number, value):
+        digest = hmac.new(key, f"{round_number}:{value}".encode(), hashlib.sha256).digest()
+        return int.from_bytes(digest[:8], "big") % _HALF
+
+    def permute(self, key, counter):
+        left, right = divmod(counter, _HALF)
+        for round_number in range(FEISTEL_ROUNDS):
+            left, right = right, (left + self._round(key, round_number, right)) % _HALF
+        return f"{left * _HALF + right:0{BARCODE_DIGITS}d}"
+
+    def reserve(self, conn, count):
+        """Reserve count barcodes in one transaction and commit it.
+
+        Legacy random barcodes that happen to collide with the permutation
+        are skipped with a single IN query per block.
+        """
+        cursor = conn.cursor()
+        key = self._load_key(cursor)
+        codes = []
+        while len(codes) < count:
+            needed = count - len(codes)
+            cursor.execute(
+                "UPDATE barcode_sequence SET next_value = LAST_INSERT_ID(next_value + %s) WHERE id = 1",
+                (needed,))
+            cursor.execute("SELECT LAST_INSERT_ID()")
+            end = cursor.fetchone()[0]
+            if end > _HALF * _HALF:
+                raise RuntimeError("Barcode space exhausted")
+            block = [self.permute(key, counter) for counter in range(end - needed, end)]
+            placeholders = ", ".join(["%s"] * len(block))
+            cursor.execute(f"SELECT barcode FROM students WHERE barcode IN ({placeholders})", tuple(block))
+            taken = {row[0] for row in cursor.fetchall()}
+            codes.extend(code for code in block if code not in taken)
+        conn.commit()
+        cursor.close()
+        return codes
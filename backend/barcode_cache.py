@@ -0,0 +1,122 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+
+BARCODE_CACHE_DIR = os.environ.get("BARCODE_CACHE_DIR", os.path.join(tempfile.gettempdir(), "barcode_cache"))
+BARCODE_CACHE_MAX_BYTES = int(os.environ.get("BARCODE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+BARCODE_CACHE_MEMORY_ITEMS = int(os.environ.get("BARCODE_CACHE_MEMORY_ITEMS", "2000"))
+
+
+class BarcodeCache:
+    """Content-addressed PNG cache: a small in-memory LRU in front of a
+    size-bounded on-disk LRU (file mtime is the recency stamp)."""
+
+    def __init__(self, directory=BARCODE_CACHE_DIR, max_bytes=BARCODE_CACHE_MAX_BYTES,
+                 memory_items=BARCODE_CACHE_MEMORY_ITEMS):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.memory_items = memory_items
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk_bytes = None
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def key(value, symbology="code128", options=None):
+        raw = json.dumps([symbology, str(value), options or {}], sort_keys=True)
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.png")
+
+    def _remember(self, key, data):
+        self._memory[key] = data
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, key):
+        with self._lock:
+            data = self._memory.get(key)
+            if data is not None:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                return data
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+            os.utime(path)
+        except OSError:
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.disk_hits += 1
+            self._remember(key, data)
+        return data
+
+    def put(self, key, data):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(temp_path, path)
+        except OSError as e:
+            print(f"Could not write barcode cache entry {path}: {str(e)}")
+        with self._lock:
+            self._remember(key, data)
+            if self._disk_bytes is not None:
+                self._disk_bytes += len(data)
+            over_budget = self._disk_bytes is None or self._disk_bytes > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def evict(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total = sum(size for _, size, _ in entries)
+        # Evict down to 90% so a full cache does not rescan on every write
+        target = self.max_bytes * 0.9 if total > self.max_bytes else total
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            try:
+                os.remove(path)
+                total -= size
+                evicted += 1
+            except OSError:
+                pass
+        with self._lock:
+            self._disk_bytes = total
+            self.evictions += evicted
+
+    def stats(self):
+        with self._lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            hits = self.memory_hits + self.disk_hits
+            return {
+                "memory_items": len(self._memory),
+                "disk_bytes": self._disk_bytes or 0,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0
+            }
@@ -0,0 +1,94 @@
+import io
+import multiprocessing
+import os
+import threading
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from barcode import Code128
+from barcode.writer import ImageWriter, SVGWriter
+from barcode_cache import BarcodeCache
+
+BARCODE_RENDER_PROCESSES = int(os.environ.get("BARCODE_RENDER_PROCESSES", str(os.cpu_count() or 1)))
+# Batches smaller than this are rendered inline; the pool round trip costs more
+BARCODE_RENDER_MIN_BATCH = int(os.environ.get("BARCODE_RENDER_MIN_BATCH", "16"))
+
+# Writer options are part of the cache key; change them here, not at call sites
+SYMBOLOGY = "code128"
+WRITER_OPTIONS = {}
+
+_pool = None
+_pool_lock = threading.Lock()
+cache = BarcodeCache()
+
+
+def render_barcode_png(barcode_number):
+    """Code128 PNG bytes for one barcode, or None if both writers fail."""
+    try:
+        output = io.BytesIO()
+        Code128(str(barcode_number), writer=ImageWriter()).write(output, WRITER_OPTIONS)
+        return output.getvalue()
+    except Exception as e:
+        print(f"ImageWriter failed for {barcode_number}: {str(e)}\n{traceback.format_exc()}")
+    try:
+        import cairosvg
+        svg = io.BytesIO()
+        Code128(str(barcode_number), writer=SVGWriter()).write(svg, WRITER_OPTIONS)
+        return cairosvg.svg2png(bytestring=svg.getvalue())
+    except Exception as e:
+        print(f"SVGWriter failed for {barcode_number}: {str(e)}\n{traceback.format_exc()}")
+        return None
+
+
+def get_pool():
+    # Also used for label document builds, so there is one worker pool per server
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            # spawn, not fork: the Flask process is multi-threaded
+            _pool = ProcessPoolExecutor(max_workers=BARCODE_RENDER_PROCESSES,
+                                        mp_context=multiprocessing.get_context("spawn"))
+        return _pool
+
+
+def render_barcodes(barcode_numbers, progress=None, parallel=True):
+    """PNG bytes (or None) for each barcode, in input order.
+
+    Cached images are served from the barcode cache; only misses are
+    rendered. progress, if given, is called as progress(done, total).
+    Pass parallel=False from inside a pool worker.
+    """
+    barcode_numbers = [str(number) for number in barcode_numbers]
+    total = len(barcode_numbers)
+    keys = [BarcodeCache.key(number, SYMBOLOGY, WRITER_OPTIONS) for number in barcode_numbers]
+    images = [cache.get(key) for key in keys]
+    missing = [idx for idx, image in enumerate(images) if image is None]
+    done = total - len(missing)
+    if progress and done:
+        progress(done, total)
+
+    to_render = [barcode_numbers[idx] for idx in missing]
+    if not parallel or BARCODE_RENDER_PROCESSES <= 1 or len(to_render) < BARCODE_RENDER_MIN_BATCH:
+        results = map(render_barcode_png, to_render)
+    else:
+        chunksize = max(1, len(to_render) // (BARCODE_RENDER_PROCESSES * 4))
+        results = get_pool().map(render_barcode_png, to_render, chunksize=chunksize)
+    for idx, image in zip(missing, results):
+        images[idx] = image
+        if image is not None:
+            cache.put(keys[idx], image)
+        done += 1
+        if progress:
+            progress(done, total)
+
+    stats = cache.stats()
+    print(f"Barcode cache: {total - len(missing)}/{total} hits this batch, "
+          f"hit rate {stats['hit_rate']:.1%} overall")
+    return images
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown()
+            _pool = None
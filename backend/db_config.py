@@ -1,9 +1,198 @@
+import os
+import queue
+import threading
+import time
 import mysql.connector
 
+DB_CONFIG = {
+    "host": os.environ.get("DB_HOST", "localhost"),
+    "port": int(os.environ.get("DB_PORT", "3306")),
+    "user": os.environ.get("DB_USER", "root"),
+    "password": os.environ.get("DB_PASSWORD", ""),
+    "database": os.environ.get("DB_NAME", "attendance_db"),
+    "consume_results": True
+}
+
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", "10"))
+DB_POOL_TIMEOUT = float(os.environ.get("DB_POOL_TIMEOUT", "5"))
+DB_POOL_PING = os.environ.get("DB_POOL_PING", "1") not in ("0", "false", "False")
+
+
+# Called as query_observer(operation, seconds) for every timed cursor call
+query_observer = None
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class TimedCursor:
+    def __init__(self, cursor):
+        self._cursor = cursor
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def _timed(self, operation, method, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return method(*args, **kwargs)
+        finally:
+            if query_observer is not None:
+                query_observer(operation, time.perf_counter() - started)
+
+    def execute(self, *args, **kwargs):
+        return self._timed("execute", self._cursor.execute, *args, **kwargs)
+
+    def executemany(self, *args, **kwargs):
+        return self._timed("executemany", self._cursor.executemany, *args, **kwargs)
+
+    def callproc(self, *args, **kwargs):
+        return self._timed("callproc", self._cursor.callproc, *args, **kwargs)
+
+    def fetchone(self):
+        return self._timed("fetch", self._cursor.fetchone)
+
+    def fetchmany(self, *args, **kwargs):
+        return self._timed("fetch", self._cursor.fetchmany, *args, **kwargs)
+
+    def fetchall(self):
+        return self._timed("fetch", self._cursor.fetchall)
+
+
+class PooledConnection:
+    """Wraps a pooled connection so that close() hands it back to the pool."""
+
+    def __init__(self, pool, conn):
+        self._pool = pool
+        self._conn = conn
+
+    def __getattr__(self, name):
+        if self._conn is None:
+            raise mysql.connector.errors.OperationalError("Connection already returned to pool")
+        return getattr(self._conn, name)
+
+    def cursor(self, *args, **kwargs):
+        cursor = self.__getattr__("cursor")(*args, **kwargs)
+        if query_observer is None:
+            return cursor
+        return TimedCursor(cursor)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return self.__getattr__("commit")()
+        finally:
+            if query_observer is not None:
+                query_observer("commit", time.perf_counter() - started)
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool.release(conn)
+
+
+class ConnectionPool:
+    def __init__(self, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, ping=DB_POOL_PING, **config):
+        self.size = size
+        self.timeout = timeout
+        self.ping = ping
+        self.config = config or DB_CONFIG
+        self._idle = queue.LifoQueue()
+        self._slots = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._in_use = 0
+        self._created = 0
+        self._checkouts = 0
+        self._timeouts = 0
+        self._reconnects = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+
+    def _connect(self):
+        conn = mysql.connector.connect(**self.config)
+        with self._lock:
+            self._created += 1
+        return conn
+
+    def get(self):
+        started = time.perf_counter()
+        if not self._slots.acquire(timeout=self.timeout):
+            with self._lock:
+                self._timeouts += 1
+            raise PoolTimeout(f"No database connection available within {self.timeout}s")
+        waited = time.perf_counter() - started
+
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._connect()
+            else:
+                if self.ping and not self._is_healthy(conn):
+                    with self._lock:
+                        self._reconnects += 1
+                    self._discard(conn)
+                    conn = self._connect()
+        except Exception:
+            self._slots.release()
+            raise
+
+        with self._lock:
+            self._in_use += 1
+            self._checkouts += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+        return PooledConnection(self, conn)
+
+    def release(self, conn):
+        try:
+            if conn.is_connected():
+                conn.rollback()
+                self._idle.put(conn)
+            else:
+                self._discard(conn)
+        except Exception:
+            self._discard(conn)
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            self._slots.release()
+
+    def _is_healthy(self, conn):
+        try:
+            conn.ping(reconnect=False)
+            return True
+        except Exception:
+            return False
+
+    def _discard(self, conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "in_use": self._in_use,
+                "idle": self._idle.qsize(),
+                "created": self._created,
+                "checkouts": self._checkouts,
+                "timeouts": self._timeouts,
+                "reconnects": self._reconnects,
+                "wait_total_ms": round(self._wait_total * 1000, 3),
+                "wait_avg_ms": round(self._wait_total * 1000 / self._checkouts, 3) if self._checkouts else 0.0,
+                "wait_max_ms": round(self._wait_max * 1000, 3)
+            }
+
+
+pool = ConnectionPool()
+
+
 def get_db_connection():
-    return mysql.connector.connect(
-        host="localhost",
-        user="root",  
-        password="", 
-        database="attendance_db"
-    )
+    return pool.get()
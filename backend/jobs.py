@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+import traceback
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+UPLOAD_WORKERS = int(os.environ.get("UPLOAD_WORKERS", "2"))
+UPLOAD_JOB_TTL = int(os.environ.get("UPLOAD_JOB_TTL", "3600"))
+
+
+class Job:
+    def __init__(self, name):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.status = "queued"
+        self.stage = "queued"
+        self.percent = 0
+        self.error = None
+        self.result = None
+        self.report = None
+        self.created = time.time()
+        self.finished = None
+
+    def update(self, stage, percent):
+        self.stage = stage
+        self.percent = max(self.percent, min(100, int(percent)))
+
+    def to_dict(self):
+        data = {
+            "id": self.id,
+            "name": self.name,
+            "status": self.status,
+            "stage": self.stage,
+            "percent": self.percent
+        }
+        if self.error:
+            data["error"] = self.error
+        if self.report is not None:
+            data["report"] = self.report
+        return data
+
+
+class JobQueue:
+    """Runs background jobs on a fixed number of worker threads.
+
+    A job function is called as fn(job, *args) and returns
+    (data, filename, mimetype), where data is bytes or a callable that
+    returns an iterator of bytes to stream; finished jobs are kept for UPLOAD_JOB_TTL
+    seconds so the result can be downloaded.
+
+    Jobs live in this process's memory: the status and result requests
+    must reach the process that accepted the upload, so the backend has to
+    run as a single process (threads are fine).
+    """
+
+    def __init__(self, workers=UPLOAD_WORKERS, ttl=UPLOAD_JOB_TTL):
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, name, fn, *args):
+        self._expire()
+        job = Job(name)
+        with self._lock:
+            self._jobs[job.id] = job
+        self._executor.submit(self._run, job, fn, args)
+        return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def _run(self, job, fn, args):
+        job.status = "running"
+        try:
+            job.result = fn(job, *args)
+            job.update("done", 100)
+            job.status = "done"
+        except Exception as e:
+            print(f"Job {job.id} ({job.name}) failed: {str(e)}\n{traceback.format_exc()}")
+            job.error = str(e)
+            job.status = "failed"
+        finally:
+            job.finished = time.time()
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        with self._lock:
+            for job_id in [job_id for job_id, job in self._jobs.items()
+                           if job.finished and job.finished < cutoff]:
+                del self._jobs[job_id]
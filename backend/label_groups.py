@@ -0,0 +1,83 @@
+import re
+import zipfile
+from concurrent.futures import as_completed
+import barcode_render
+from labels import LabelDocument
+from label_pdf import LabelPDF
+
+# group_by values accepted by /upload, mapped to the index of the roster column
+GROUP_COLUMNS = {"department": 3, "batch": 1, "school": 4}
+
+
+def build_group_labels(students, label_format):
+    """Label document bytes for one group; runs in a pool worker."""
+    if label_format == "pdf":
+        doc = LabelPDF()
+        doc.add(students)
+    else:
+        barcode_numbers = [barcode for _, barcode in students]
+        images = barcode_render.render_barcodes(barcode_numbers, parallel=False)
+        doc = LabelDocument()
+        doc.add(students, {number: image for number, image in zip(barcode_numbers, images) if image})
+    return doc.save().getvalue()
+
+
+class _ZipStream:
+    # Minimal unseekable sink; zipfile falls back to data descriptors for it
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b"".join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def group_filenames(groups, label_format):
+    names = {}
+    for group in groups:
+        base = re.sub(r"[^\w\- ]+", "_", group).strip() or "Unassigned"
+        name = f"{base}.{label_format}"
+        suffix = 2
+        while name in names.values():
+            name = f"{base}_{suffix}.{label_format}"
+            suffix += 1
+        names[group] = name
+    return names
+
+
+def stream_group_labels(groups, label_format):
+    """Yield a ZIP of one label document per group as the groups finish.
+
+    groups maps a group name to its (name, barcode) pairs. Documents are
+    built in parallel on the barcode render pool, largest group first, and
+    each is written to the archive as soon as its worker returns, so the
+    first bytes go out after the first group rather than the whole roster.
+    """
+    filenames = group_filenames(groups, label_format)
+    pool = barcode_render.get_pool()
+    futures = {pool.submit(build_group_labels, students, label_format): group
+               for group, students in sorted(groups.items(), key=lambda item: -len(item[1]))}
+    sink = _ZipStream()
+    try:
+        with zipfile.ZipFile(sink, "w", zipfile.ZIP_STORED) as archive:
+            for future in as_completed(futures):
+                group = futures[future]
+                try:
+                    archive.writestr(filenames[group], future.result())
+                except Exception as e:
+                    print(f"Error building labels for group {group}: {str(e)}")
+                    archive.writestr(f"{filenames[group]}.error.txt", str(e))
+                yield sink.drain()
+        yield sink.drain()
+    finally:
+        # The client may have gone away; don't build groups nobody will receive
+        for future in futures:
+            future.cancel()
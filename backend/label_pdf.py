@@ -0,0 +1,177 @@
+import io
+import textwrap
+import zlib
+from barcode import Code128
+import metrics
+from labels import LABEL_COLUMNS, LABEL_ROWS, PAGE_WIDTH, PAGE_HEIGHT, SHEET_MARGIN_X, SHEET_MARGIN_Y
+
+PDF_MIMETYPE = "application/pdf"
+
+POINTS = 72
+NAME_SIZE = 9
+# Long names shrink down to this size, then wrap onto up to NAME_MAX_LINES lines
+NAME_MIN_SIZE = 6
+NAME_MAX_LINES = 3
+DIGITS_SIZE = 7
+BAR_HEIGHT = 0.4 * POINTS
+CELL_PADDING = 0.1 * POINTS
+# Code128 wants a clear margin of at least 10 modules either side
+QUIET_ZONE = 10
+# Courier is monospaced, so text can be centred without font metrics
+CHAR_WIDTH = 0.6
+
+CATALOG_ID, PAGES_ID, NAME_FONT_ID, DIGITS_FONT_ID = 1, 2, 3, 4
+
+
+def pdf_text(value):
+    value = str(value).encode("cp1252", errors="replace")
+    return b"(" + value.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+def barcode_bars(barcode_number):
+    """(start module, width in modules) for each bar of the Code128 pattern."""
+    pattern = Code128(str(barcode_number)).build()[0]
+    bars = []
+    start = None
+    for idx, module in enumerate(pattern + "0"):
+        if module == "1" and start is None:
+            start = idx
+        elif module == "0" and start is not None:
+            bars.append((start, idx - start))
+            start = None
+    return bars, len(pattern)
+
+
+class LabelPDF:
+    """Name + barcode labels as a vector PDF, on the same grid as the label sheet.
+
+    Bars are drawn as filled rectangles, so nothing is rasterised. Each
+    page is serialised as soon as it is full, so only the current page's
+    drawing operations are kept as a list. Takes the same add()/save()
+    calls as LabelDocument.
+    """
+
+    def __init__(self, columns=LABEL_COLUMNS, rows=LABEL_ROWS):
+        self.columns = columns
+        self.rows = rows
+        self.count = 0
+        self.cell_width = (PAGE_WIDTH - 2 * SHEET_MARGIN_X) * POINTS / columns
+        self.cell_height = (PAGE_HEIGHT - 2 * SHEET_MARGIN_Y) * POINTS / rows
+        self._buffer = bytearray()
+        self._written = 0
+        self._offsets = {}
+        self._next_id = DIGITS_FONT_ID + 1
+        self._pages = []
+        self._page = []
+        self._finished = False
+
+        self._write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self._object(NAME_FONT_ID, b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier-Bold "
+                                   b"/Encoding /WinAnsiEncoding >>")
+        self._object(DIGITS_FONT_ID, b"<< /Type /Font /Subtype /Type1 /BaseFont /Courier "
+                                     b"/Encoding /WinAnsiEncoding >>")
+
+    def _write(self, data):
+        self._buffer += data
+        self._written += len(data)
+
+    def _object(self, object_id, body):
+        self._offsets[object_id] = self._written
+        self._write(b"%d 0 obj\n" % object_id + body + b"\nendobj\n")
+
+    def _new_id(self):
+        object_id = self._next_id
+        self._next_id += 1
+        return object_id
+
+    def _text(self, font, size, x, y, value):
+        return b"BT /%s %.2f Tf %.2f %.2f Td %s Tj ET" % (font, size, x, y, pdf_text(value))
+
+    def _label(self, name, barcode_number, position):
+        column, row = position % self.columns, position // self.columns
+        left = SHEET_MARGIN_X * POINTS + column * self.cell_width
+        top = (PAGE_HEIGHT - SHEET_MARGIN_Y) * POINTS - row * self.cell_height
+        centre = left + self.cell_width / 2
+        inner_width = self.cell_width - 2 * CELL_PADDING
+
+        size = NAME_SIZE
+        if len(name) * size * CHAR_WIDTH > inner_width:
+            size = max(NAME_MIN_SIZE, inner_width / (len(name) * CHAR_WIDTH))
+        max_chars = int(inner_width / (size * CHAR_WIDTH) + 1e-6)
+        lines = textwrap.wrap(name, max_chars) or [name]
+        if len(lines) > NAME_MAX_LINES:
+            lines = lines[:NAME_MAX_LINES]
+            lines[-1] = lines[-1][:max_chars - 3] + "..."
+        ops = []
+        baseline = top - CELL_PADDING
+        for line in lines:
+            baseline -= size
+            ops.append(self._text(b"F1", size, centre - len(line) * size * CHAR_WIDTH / 2, baseline, line))
+            baseline -= size * 0.15
+
+        bars, modules = barcode_bars(barcode_number)
+        module_width = inner_width / (modules + 2 * QUIET_ZONE)
+        bar_bottom = baseline - 4 - BAR_HEIGHT
+        bar_left = centre - modules * module_width / 2
+        for start, width in bars:
+            ops.append(b"%.3f %.2f %.3f %.2f re" % (
+                bar_left + start * module_width, bar_bottom, width * module_width, BAR_HEIGHT))
+        ops.append(b"f")
+        digits = str(barcode_number)
+        ops.append(self._text(b"F2", DIGITS_SIZE, centre - len(digits) * DIGITS_SIZE * CHAR_WIDTH / 2,
+                              bar_bottom - DIGITS_SIZE - 1, digits))
+        return b"\n".join(ops)
+
+    def _flush_page(self):
+        if not self._page:
+            return
+        content = zlib.compress(b"\n".join(self._page))
+        content_id, page_id = self._new_id(), self._new_id()
+        self._object(content_id, b"<< /Length %d /Filter /FlateDecode >>\nstream\n" % len(content)
+                     + content + b"\nendstream")
+        self._object(page_id, b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %d %d] "
+                              b"/Resources << /Font << /F1 %d 0 R /F2 %d 0 R >> >> /Contents %d 0 R >>"
+                     % (PAGES_ID, PAGE_WIDTH * POINTS, PAGE_HEIGHT * POINTS,
+                        NAME_FONT_ID, DIGITS_FONT_ID, content_id))
+        self._pages.append(page_id)
+        self._page = []
+
+    @metrics.stage_latency.time("add_pdf_labels")
+    def add(self, students, barcode_images=None):
+        # students is (name, barcode) pairs; barcode_images is accepted for
+        # LabelDocument compatibility and ignored, the bars are drawn directly
+        per_page = self.columns * self.rows
+        for name, barcode_number in students:
+            if not name:
+                print(f"Skipping barcode {barcode_number}: No name")
+                continue
+            try:
+                self._page.append(self._label(str(name), barcode_number, self.count % per_page))
+            except Exception as e:
+                print(f"Error drawing barcode for {name}: {str(e)}")
+                continue
+            self.count += 1
+            if self.count % per_page == 0:
+                self._flush_page()
+
+    def finish(self):
+        if self._finished:
+            return
+        self._finished = True
+        self._flush_page()
+        kids = b" ".join(b"%d 0 R" % page_id for page_id in self._pages)
+        self._object(PAGES_ID, b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self._pages)))
+        self._object(CATALOG_ID, b"<< /Type /Catalog /Pages %d 0 R >>" % PAGES_ID)
+        xref = self._written
+        self._write(b"xref\n0 %d\n0000000000 65535 f \n" % self._next_id)
+        for object_id in range(1, self._next_id):
+            self._write(b"%010d 00000 n \n" % self._offsets[object_id])
+        self._write(b"trailer\n<< /Size %d /Root %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                    % (self._next_id, CATALOG_ID, xref))
+
+    @metrics.stage_latency.time("save_pdf_labels")
+    def save(self):
+        self.finish()
+        output = io.BytesIO(bytes(self._buffer))
+        print(f"PDF built: {self.count} labels, {len(self._pages)} pages, {self._written} bytes")
+        return output
@@ -0,0 +1,127 @@
+import io
+import os
+from docx import Document
+from docx.enum.table import WD_ROW_HEIGHT_RULE
+from docx.enum.text import WD_PARAGRAPH_ALIGNMENT
+from docx.image.image import Image
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.opc.packuri import PackURI
+from docx.oxml.shape import CT_Inline
+from docx.parts.image import ImagePart
+from docx.shared import Inches, Pt
+import metrics
+
+# "sheet" packs labels into a LABEL_COLUMNS x LABEL_ROWS grid per page
+# (3 x 10 matches Avery 5160 style sheets); "list" is one label per paragraph
+LABEL_LAYOUT = os.environ.get("LABEL_LAYOUT", "sheet")
+LABEL_COLUMNS = int(os.environ.get("LABEL_COLUMNS", "3"))
+LABEL_ROWS = int(os.environ.get("LABEL_ROWS", "10"))
+
+PAGE_WIDTH = 8.5
+PAGE_HEIGHT = 11
+SHEET_MARGIN_X = 0.19
+SHEET_MARGIN_Y = 0.5
+
+DOCX_MIMETYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+
+class LabelDocument:
+    """A Word document of name + barcode labels, filled in one or more add() calls.
+
+    Each distinct barcode image is stored once as an image part and every
+    label showing it points at that part. python-docx would also dedupe,
+    but by hashing every existing image part on each insert, which is
+    quadratic over a roster; shape ids are counted here for the same reason.
+    """
+
+    def __init__(self, layout=LABEL_LAYOUT, columns=LABEL_COLUMNS, rows=LABEL_ROWS):
+        self.layout = layout
+        self.columns = columns
+        self.rows = rows
+        self.count = 0
+        self._doc = Document()
+        self._images = {}
+        self._table = None
+        self._row = None
+        self._next_shape_id = None
+
+        section = self._doc.sections[0]
+        section.page_height = Inches(PAGE_HEIGHT)
+        section.page_width = Inches(PAGE_WIDTH)
+        if layout == "sheet":
+            section.top_margin = section.bottom_margin = Inches(SHEET_MARGIN_Y)
+            section.left_margin = section.right_margin = Inches(SHEET_MARGIN_X)
+            self.cell_width = (PAGE_WIDTH - 2 * SHEET_MARGIN_X) / columns
+            self.cell_height = (PAGE_HEIGHT - 2 * SHEET_MARGIN_Y) / rows
+        else:
+            section.top_margin = section.bottom_margin = Inches(0.5)
+            section.left_margin = section.right_margin = Inches(0.7)
+
+    def _image_rid(self, barcode_number, image):
+        if barcode_number not in self._images:
+            partname = PackURI(f"/word/media/barcode{len(self._images) + 1}.png")
+            part = ImagePart.from_image(Image.from_blob(image), partname)
+            self._images[barcode_number] = self._doc.part.relate_to(part, RT.IMAGE)
+        return self._images[barcode_number]
+
+    def _add_picture(self, run, barcode_number, image, width, height):
+        rid = self._image_rid(barcode_number, image)
+        # part.next_id rescans the whole document for ids; count from it once instead
+        if self._next_shape_id is None:
+            self._next_shape_id = self._doc.part.next_id
+        shape_id = self._next_shape_id
+        self._next_shape_id += 1
+        inline = CT_Inline.new_pic_inline(
+            shape_id, rid, f"{barcode_number}.png", Inches(width), Inches(height))
+        run._r.add_drawing(inline)
+
+    def _next_cell(self):
+        if self._table is None:
+            self._table = self._doc.add_table(rows=0, cols=self.columns)
+            self._table.autofit = False
+        position = self.count % self.columns
+        if position == 0:
+            self._row = self._table.add_row()
+            self._row.height = Inches(self.cell_height)
+            self._row.height_rule = WD_ROW_HEIGHT_RULE.EXACTLY
+            for cell in self._row.cells:
+                cell.width = Inches(self.cell_width)
+        return self._row.cells[position]
+
+    def _fill(self, paragraph, name, barcode_number, image, name_size, width, height):
+        paragraph.alignment = WD_PARAGRAPH_ALIGNMENT.CENTER
+        run = paragraph.add_run(f"{name}\n")
+        run.bold = True
+        run.font.size = Pt(name_size)
+        if image:
+            try:
+                self._add_picture(paragraph.add_run(), barcode_number, image, width, height)
+            except Exception as e:
+                paragraph.add_run(f"[ERROR: Could not add barcode image: {str(e)}]")
+                print(f"Error adding barcode image for {name}: {str(e)}")
+        else:
+            print(f"No barcode image for {name}, skipping barcode")
+
+    @metrics.stage_latency.time("add_labels")
+    def add(self, students, barcode_images):
+        # students is (name, barcode) pairs; barcode_images maps barcode -> PNG bytes
+        for name, barcode_number in students:
+            if not name:
+                print(f"Skipping barcode {barcode_number}: No name")
+                continue
+            image = barcode_images.get(barcode_number)
+            if self.layout == "sheet":
+                paragraph = self._next_cell().paragraphs[0]
+                self._fill(paragraph, name, barcode_number, image, 9,
+                           min(self.cell_width - 0.2, 1.8), min(self.cell_height - 0.35, 0.55))
+            else:
+                self._fill(self._doc.add_paragraph(), name, barcode_number, image, 14, 1.5, 0.75)
+            self.count += 1
+
+    @metrics.stage_latency.time("save_labels")
+    def save(self):
+        output = io.BytesIO()
+        self._doc.save(output)
+        print(f"Document built: {self.count} labels, {len(self._images)} images, {output.tell()} bytes")
+        output.seek(0)
+        return output
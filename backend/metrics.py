@@ -0,0 +1,150 @@
+import threading
+import time
+import weakref
+from bisect import bisect_left
+from functools import wraps
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+class _ShardHolder:
+    __slots__ = ("shard", "__weakref__")
+
+    def __init__(self, shard):
+        self.shard = shard
+
+
+class _Metric:
+    """Counters live in per-thread shards so the hot path never takes a lock;
+    shards are only summed when /metrics is scraped. A shard outlives its
+    thread and is handed to the next new thread, so thread-per-request
+    servers do not grow the shard list."""
+
+    def __init__(self, name, help_text, label_name):
+        self.name = name
+        self.help_text = help_text
+        self.label_name = label_name
+        self._local = threading.local()
+        self._shards = []
+        self._free = []
+        self._shards_lock = threading.Lock()
+        registry.append(self)
+
+    def _shard(self):
+        try:
+            return self._local.holder.shard
+        except AttributeError:
+            with self._shards_lock:
+                if self._free:
+                    shard = self._free.pop()
+                else:
+                    shard = {}
+                    self._shards.append(shard)
+            holder = self._local.holder = _ShardHolder(shard)
+            weakref.finalize(holder, self._release, shard)
+            return shard
+
+    def _release(self, shard):
+        with self._shards_lock:
+            self._free.append(shard)
+
+    def _merged(self):
+        with self._shards_lock:
+            shards = list(self._shards)
+        merged = {}
+        for shard in shards:
+            for label, values in list(shard.items()):
+                if label in merged:
+                    merged[label] = [a + b for a, b in zip(merged[label], values)]
+                else:
+                    merged[label] = list(values)
+        return merged
+
+
+class Counter(_Metric):
+    def inc(self, label, amount=1):
+        shard = self._shard()
+        values = shard.get(label)
+        if values is None:
+            values = shard[label] = [0]
+        values[0] += amount
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} counter"]
+        for label, values in sorted(self._merged().items()):
+            lines.append(f'{self.name}{{{self.label_name}="{label}"}} {values[0]}')
+        return lines
+
+
+class Histogram(_Metric):
+    def __init__(self, name, help_text, label_name, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, label_name)
+        self.buckets = tuple(buckets)
+
+    def observe(self, label, seconds):
+        shard = self._shard()
+        values = shard.get(label)
+        if values is None:
+            # one slot per bucket, +Inf, then sum and count
+            values = shard[label] = [0] * (len(self.buckets) + 1) + [0.0, 0]
+        values[bisect_left(self.buckets, seconds)] += 1
+        values[-2] += seconds
+        values[-1] += 1
+
+    def time(self, label):
+        def decorator(func):
+            @wraps(func)
+            def wrapper(*args, **kwargs):
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.observe(label, time.perf_counter() - started)
+            return wrapper
+        return decorator
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help_text}", f"# TYPE {self.name} histogram"]
+        for label, values in sorted(self._merged().items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), values):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{self.name}_bucket{{{self.label_name}="{label}",le="{le}"}} {cumulative}')
+            lines.append(f'{self.name}_sum{{{self.label_name}="{label}"}} {values[-2]}')
+            lines.append(f'{self.name}_count{{{self.label_name}="{label}"}} {values[-1]}')
+        return lines
+
+
+class Gauges:
+    """Numeric fields of a stats() callable exposed as gauges at scrape time."""
+
+    def __init__(self, prefix, collect):
+        self.prefix = prefix
+        self.collect = collect
+        registry.append(self)
+
+    def render(self):
+        lines = []
+        for key, value in self.collect().items():
+            if isinstance(value, bool) or not isinstance(value, (int, float)):
+                continue
+            lines.append(f"# TYPE {self.prefix}_{key} gauge")
+            lines.append(f"{self.prefix}_{key} {value}")
+        return lines
+
+
+registry = []
+
+http_requests = Counter("http_requests_total", "HTTP requests by route.", "route")
+http_errors = Counter("http_request_errors_total", "HTTP responses with status >= 500 by route.", "route")
+http_latency = Histogram("http_request_duration_seconds", "HTTP request latency by route.", "route")
+db_latency = Histogram("db_query_duration_seconds", "Time spent in database calls by operation.", "operation")
+stage_latency = Histogram("stage_duration_seconds", "Time spent in barcode and document generation.", "stage")
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,166 @@
+"""Versioned schema migrations for attendance_db.
+
+    python migrate.py               apply pending migrations
+    python migrate.py status        list applied and pending migrations
+    python migrate.py baseline N    mark migrations up to N as applied
+    python migrate.py check         EXPLAIN the hot queries, exit 1 on full scans/filesorts
+
+Migrations live in database/migrations as NNN_description.sql and are
+recorded in the schema_migrations table. Run `check` against a database
+with representative data; on near-empty tables MySQL prefers full scans.
+"""
+import os
+import re
+import sys
+from db_config import get_db_connection
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "database", "migrations")
+
+# (name, query, params, filesort allowed). Shapes mirror app3.py.
+PLAN_CHECKS = [
+    ("attendance by date", """
+        SELECT s.name, s.batch, s.position, s.department, s.school, a.date, a.time_in, a.time_out
+        FROM attendance a JOIN students s ON a.student_id = s.id
+        WHERE a.date = %s ORDER BY a.date DESC""", ("2025-03-05",), False),
+    ("attendance by date and department", """
+        SELECT s.name, s.batch, s.position, s.department, s.school, a.date, a.time_in, a.time_out
+        FROM attendance a JOIN students s ON a.student_id = s.id
+        WHERE s.department = %s AND a.date = %s ORDER BY a.date DESC""", ("IT", "2025-03-05"), False),
+    ("attendance page", """
+        SELECT a.id, s.name, s.batch, s.position, s.department, s.school, a.date, a.time_in, a.time_out
+        FROM attendance a JOIN students s ON a.student_id = s.id
+        WHERE (a.date < %s OR (a.date = %s AND a.id < %s))
+        ORDER BY a.date DESC, a.id DESC LIMIT 101""", ("2025-03-05", "2025-03-05", 1000), False),
+    ("download by date", """
+        SELECT s.name, s.batch, s.position, s.department, s.school, a.date, a.time_in, a.time_out
+        FROM attendance a JOIN students s ON a.student_id = s.id
+        WHERE a.date = %s ORDER BY a.date DESC, s.name ASC""", ("2025-03-05",), True),
+    ("download by school", """
+        SELECT s.name, s.batch, s.position, s.department, s.school, a.date, a.time_in, a.time_out
+        FROM attendance a JOIN students s ON a.student_id = s.id
+        WHERE s.school = %s ORDER BY a.date DESC, s.name ASC""", ("Sample School",), True),
+    ("today's attendance", """
+        SELECT a.student_id, a.id, a.time_in, a.time_out, s.name, s.batch, s.position, s.department, s.school
+        FROM attendance a JOIN students s ON a.student_id = s.id
+        WHERE a.date = %s ORDER BY a.id""", ("2025-03-05",), True),
+]
+
+
+def migration_files():
+    migrations = []
+    for filename in sorted(os.listdir(MIGRATIONS_DIR)):
+        match = re.match(r"^(\d+)_(.+)\.sql$", filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(MIGRATIONS_DIR, filename)))
+    return migrations
+
+
+def split_statements(sql):
+    # Honours mysql-client DELIMITER lines so stored procedures can be migrated
+    statements = []
+    delimiter = ";"
+    current = []
+    for line in sql.splitlines():
+        stripped = line.strip()
+        if not current and (not stripped or stripped.startswith("--")):
+            continue
+        if stripped.upper().startswith("DELIMITER "):
+            delimiter = stripped.split()[1]
+            continue
+        current.append(line)
+        if stripped.endswith(delimiter):
+            statement = "\n".join(current).rstrip()[:-len(delimiter)].strip()
+            if statement:
+                statements.append(statement)
+            current = []
+    if "\n".join(current).strip():
+        statements.append("\n".join(current).strip())
+    return statements
+
+
+def ensure_table(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INT NOT NULL PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+def applied_versions(cursor):
+    ensure_table(cursor)
+    cursor.execute("SELECT version FROM schema_migrations")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def migrate(conn):
+    cursor = conn.cursor()
+    applied = applied_versions(cursor)
+    for version, name, path in migration_files():
+        if version in applied:
+            continue
+        print(f"Applying migration {version:03d} {name}")
+        with open(path, encoding="utf-8") as f:
+            statements = split_statements(f.read())
+        # MySQL DDL commits implicitly, so a failed migration is not rolled back
+        # and must be fixed up by hand before re-running.
+        for statement in statements:
+            cursor.execute(statement)
+        cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+        conn.commit()
+    print("Database is up to date")
+
+
+def status(conn):
+    cursor = conn.cursor()
+    applied = applied_versions(cursor)
+    for version, name, _ in migration_files():
+        print(f"{version:03d} {name}: {'applied' if version in applied else 'pending'}")
+
+
+def baseline(conn, upto):
+    cursor = conn.cursor()
+    applied = applied_versions(cursor)
+    for version, name, _ in migration_files():
+        if version <= upto and version not in applied:
+            cursor.execute("INSERT INTO schema_migrations (version, name) VALUES (%s, %s)", (version, name))
+            print(f"Marked {version:03d} {name} as applied")
+    conn.commit()
+
+
+def check_plans(conn):
+    cursor = conn.cursor(dictionary=True)
+    failures = []
+    for name, query, params, filesort_allowed in PLAN_CHECKS:
+        cursor.execute("EXPLAIN " + query, params)
+        for row in cursor.fetchall():
+            extra = row.get("Extra") or ""
+            if row.get("type") == "ALL":
+                failures.append(f"{name}: full scan of {row.get('table')}")
+            if "filesort" in extra and not filesort_allowed:
+                failures.append(f"{name}: filesort on {row.get('table')}")
+        print(f"checked {name}")
+    for failure in failures:
+        print(f"FAIL {failure}")
+    return not failures
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "migrate"
+    conn = get_db_connection()
+    try:
+        if command == "migrate":
+            migrate(conn)
+        elif command == "status":
+            status(conn)
+        elif command == "baseline" and len(sys.argv) > 2:
+            baseline(conn, int(sys.argv[2]))
+        elif command == "check":
+            if not check_plans(conn):
+                sys.exit(1)
+        else:
+            print(__doc__)
+            sys.exit(2)
+    finally:
+        conn.close()
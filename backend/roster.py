@@ -0,0 +1,277 @@
+import os
+import mysql.connector
+import openpyxl
+import pandas as pd
+
+ROSTER_INSERT_BATCH = int(os.environ.get("ROSTER_INSERT_BATCH", "500"))
+ROSTER_CHUNK_SIZE = int(os.environ.get("ROSTER_CHUNK_SIZE", "1000"))
+# Columns that identify an existing student on re-upload, e.g. "Name,School"
+ROSTER_MATCH_ON = [col.strip() for col in os.environ.get("ROSTER_MATCH_ON", "Barcode").split(",")]
+
+STUDENT_COLUMNS = ["Name", "Batch", "Position", "Department", "School", "Barcode"]
+REQUIRED_COLUMNS = ["Name", "Batch", "Position", "Department", "School"]
+# VARCHAR widths of the students table
+COLUMN_WIDTHS = {"Name": 255, "Batch": 50, "Position": 100, "Department": 100, "School": 100, "Barcode": 20}
+
+INSERT_STUDENTS = (
+    "INSERT INTO students (Name, Batch, Position, Department, School, Barcode) "
+    "VALUES (%s, %s, %s, %s, %s, %s)"
+)
+
+
+def cell_text(value):
+    if value is None:
+        return ""
+    # Excel stores typed-in barcodes as numbers; 123456789012.0 -> "123456789012"
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+class RosterReader:
+    """Streams student rows out of an .xlsx roster in read-only mode.
+
+    Iterating yields lists of at most chunk_size (row_number, values)
+    pairs, values being a tuple of strings in STUDENT_COLUMNS order; Barcode
+    is empty when the sheet has no Barcode column. Blank rows are skipped.
+    Only one chunk of rows is held in memory at a time.
+    """
+
+    def __init__(self, path, chunk_size=ROSTER_CHUNK_SIZE):
+        self.chunk_size = chunk_size
+        self._workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        self._rows = self._workbook.active.iter_rows(values_only=True)
+        header = [cell_text(value) for value in next(self._rows, ())]
+        if not all(col in header for col in REQUIRED_COLUMNS):
+            self.close()
+            raise ValueError("Missing required columns")
+        self._positions = [header.index(col) if col in header else None for col in STUDENT_COLUMNS]
+
+    def __iter__(self):
+        chunk = []
+        for row_number, row in enumerate(self._rows, 2):
+            values = tuple(
+                cell_text(row[pos]) if pos is not None and pos < len(row) else ""
+                for pos in self._positions)
+            if not any(values):
+                continue
+            chunk.append((row_number, values))
+            if len(chunk) >= self.chunk_size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
+    def close(self):
+        self._workbook.close()
+
+
+def roster_frames(path, chunk_size=ROSTER_CHUNK_SIZE):
+    """The roster a chunk at a time, as frames of strings indexed by spreadsheet row number."""
+    reader = RosterReader(path, chunk_size)
+    try:
+        for chunk in reader:
+            row_numbers, rows = zip(*chunk)
+            yield pd.DataFrame(list(rows), columns=STUDENT_COLUMNS, index=pd.Index(row_numbers, name="row"))
+    finally:
+        reader.close()
+
+
+def frame_rows(frame):
+    """(row_number, values) pairs, the shape insert_students takes."""
+    return list(zip(frame.index.tolist(), frame.itertuples(index=False, name=None)))
+
+
+def error_list(problems):
+    if not problems:
+        return []
+    errors = pd.concat(problems).sort_values("row", kind="stable")
+    return [{"row": int(row), "column": column, "value": value, "error": error}
+            for row, column, value, error in errors.itertuples(index=False, name=None)]
+
+
+def taken_barcodes(conn, barcodes):
+    """Those of barcodes already assigned to a student, in one IN query."""
+    if not barcodes:
+        return set()
+    cursor = conn.cursor()
+    cursor.execute(f"SELECT barcode FROM students WHERE barcode IN ({', '.join(['%s'] * len(barcodes))})",
+                   tuple(barcodes))
+    taken = {row[0] for row in cursor.fetchall()}
+    cursor.close()
+    return taken
+
+
+def validate_roster(conn, path, match_on=None, chunk_size=ROSTER_CHUNK_SIZE):
+    """Every problem in the roster, found before anything is written.
+
+    The file is streamed a chunk at a time, so memory follows the chunk
+    size rather than the file. Each chunk is checked column-wise for blank
+    required fields and values longer than the column allows. Names,
+    barcodes and the match_on key repeated anywhere in the file are found
+    through running dicts of the values seen so far. Barcodes already taken
+    cost one IN query per chunk; an upsert (match_on given) runs
+    diff_roster on each chunk instead. Returns (row count, errors), errors
+    being {"row", "column", "value", "error"} dicts sorted by row; empty if
+    the roster is clean.
+    """
+    problems = []
+    repeat_checks = [("Name", ["Name"], "Appears more than once in the file"),
+                     ("Barcode", ["Barcode"], "Appears more than once in the file")]
+    if match_on and match_on not in (["Name"], ["Barcode"]):
+        repeat_checks.append((",".join(match_on), match_on, "Matches the same student as another row"))
+    # value -> first row it appeared on, or None once that row has been reported
+    seen = [{} for _ in repeat_checks]
+    count = 0
+
+    def report(frame, mask, column, error):
+        if mask.any():
+            problems.append(pd.DataFrame({
+                "row": frame.index[mask], "column": column,
+                "value": frame.loc[mask, column].to_numpy(), "error": error}))
+
+    for frame in roster_frames(path, chunk_size):
+        count += len(frame)
+        for column in REQUIRED_COLUMNS:
+            report(frame, frame[column] == "", column, "Required value is blank")
+        for column, width in COLUMN_WIDTHS.items():
+            report(frame, frame[column].str.len() > width, column, f"Longer than {width} characters")
+
+        for (label, columns, error), first_rows in zip(repeat_checks, seen):
+            keyed = frame.loc[(frame[columns] != "").all(axis=1), columns]
+            rows = []
+            values = []
+            for row, value in zip(keyed.index, keyed.itertuples(index=False, name=None)):
+                first = first_rows.setdefault(value, row)
+                if first == row:
+                    continue
+                if first is not None:
+                    rows.append(first)
+                    values.append(value[0])
+                    first_rows[value] = None
+                rows.append(row)
+                values.append(value[0])
+            if rows:
+                problems.append(pd.DataFrame({"row": rows, "column": label, "value": values, "error": error}))
+
+        if match_on:
+            errors = diff_roster(conn, frame, match_on)[3]
+            if errors:
+                problems.append(pd.DataFrame(errors))
+        else:
+            taken = taken_barcodes(conn, frame.loc[frame["Barcode"] != "", "Barcode"].unique().tolist())
+            report(frame, frame["Barcode"].isin(taken), "Barcode", "Already assigned to an existing student")
+
+    return count, error_list(problems)
+
+
+def diff_roster(conn, frame, key=ROSTER_MATCH_ON):
+    """Match a chunk of an upload against existing students on the key columns.
+
+    Only existing students sharing a value of the first key column with the
+    chunk are fetched, in one query, and hash-joined to it in memory. Keys
+    repeated within the file are validate_roster's to report. Returns
+    (new, changes, unchanged, errors): new is the frame of rows with no
+    match, changes is (id, {column: value}) with just the differing
+    details of each changed student, unchanged is a count, and errors uses
+    the validate_roster format. Existing students always keep their barcode.
+    """
+    params = tuple(frame.loc[frame[key[0]] != "", key[0]].unique().tolist())
+    cursor = conn.cursor()
+    query = "SELECT id, name, batch, position, department, school, barcode FROM students"
+    query += f" WHERE {key[0].lower()} IN ({', '.join(['%s'] * len(params))})" if params else " WHERE FALSE"
+    cursor.execute(query, params)
+    existing = pd.DataFrame(cursor.fetchall(), columns=["id"] + STUDENT_COLUMNS)
+    cursor.close()
+
+    problems = []
+
+    def report(rows, column, values, error):
+        if len(rows):
+            problems.append(pd.DataFrame({"row": rows, "column": column, "value": values, "error": error}))
+
+    uploaded = frame.reset_index()
+    matchable = (uploaded[key] != "").all(axis=1)
+
+    ambiguous = existing.duplicated(key, keep=False)
+    merged = uploaded[matchable].merge(existing[~ambiguous], on=key, how="left", suffixes=("", "_db"))
+    clashes = uploaded[matchable].merge(existing.loc[ambiguous, key].drop_duplicates(), on=key)
+    report(clashes["row"], ",".join(key), clashes[key[0]].to_numpy(), "Matches more than one existing student")
+    merged = merged[~merged["row"].isin(clashes["row"])]
+
+    matched = merged[merged["id"].notna()]
+    if "Barcode_db" in merged.columns:
+        moved = (matched["Barcode"] != "") & (matched["Barcode"] != matched["Barcode_db"])
+        report(matched.loc[moved, "row"], "Barcode", matched.loc[moved, "Barcode"].to_numpy(),
+               "Differs from the matched student's barcode")
+        new_rows = uploaded[~uploaded["row"].isin(matched["row"])]
+        taken = taken_barcodes(conn, new_rows.loc[new_rows["Barcode"] != "", "Barcode"].unique().tolist())
+        taken = new_rows["Barcode"].isin(taken)
+        report(new_rows.loc[taken, "row"], "Barcode", new_rows.loc[taken, "Barcode"].to_numpy(),
+               "Already assigned to an existing student")
+
+    detail_columns = [col for col in REQUIRED_COLUMNS if col not in key]
+    differs = matched[detail_columns].to_numpy() != matched[[f"{col}_db" for col in detail_columns]].to_numpy()
+    changed = differs.any(axis=1)
+    changes = []
+    rows = matched.loc[changed, ["id"] + detail_columns].itertuples(index=False, name=None)
+    for (student_id, *values), row_differs in zip(rows, differs[changed]):
+        changes.append((int(student_id), {col: value for col, value, differ
+                                          in zip(detail_columns, values, row_differs) if differ}))
+
+    new = frame.loc[~frame.index.isin(matched["row"]) & ~frame.index.isin(clashes["row"])]
+    return new, changes, len(matched) - len(changes), error_list(problems)
+
+
+def update_students(conn, changes, batch_size=ROSTER_INSERT_BATCH):
+    """Write (id, {column: value}) changes from diff_roster; the caller commits.
+
+    Changes are grouped by which columns differ and each group is sent as
+    batches of UPDATE ... WHERE id = %s setting only those columns. A
+    student deleted since the diff stays deleted.
+    """
+    groups = {}
+    for student_id, values in changes:
+        groups.setdefault(tuple(values), []).append(tuple(values.values()) + (student_id,))
+    cursor = conn.cursor()
+    for columns, params in groups.items():
+        query = f"UPDATE students SET {', '.join(f'{col.lower()} = %s' for col in columns)} WHERE id = %s"
+        for start in range(0, len(params), batch_size):
+            cursor.executemany(query, params[start:start + batch_size])
+    cursor.close()
+
+
+def insert_students(conn, rows, batch_size=ROSTER_INSERT_BATCH):
+    """Insert (row_number, values) pairs with multi-row INSERTs.
+
+    Rosters are validated first, so failures here are rows that raced
+    another writer. Each batch runs under a savepoint. A batch that hits a
+    constraint error is split in half and retried until the offending rows
+    are isolated, so one duplicate costs O(log batch) extra statements
+    instead of aborting the upload. Returns (inserted row numbers, failures); the caller commits.
+    """
+    cursor = conn.cursor()
+    inserted = []
+    failures = []
+
+    def insert(chunk):
+        cursor.execute("SAVEPOINT roster_batch")
+        try:
+            cursor.executemany(INSERT_STUDENTS, [values for _, values in chunk])
+            cursor.execute("RELEASE SAVEPOINT roster_batch")
+            inserted.extend(row_number for row_number, _ in chunk)
+        except mysql.connector.IntegrityError as e:
+            cursor.execute("ROLLBACK TO SAVEPOINT roster_batch")
+            if len(chunk) == 1:
+                row_number, values = chunk[0]
+                failures.append({"row": row_number, "name": values[0], "barcode": values[5], "error": e.msg})
+                return
+            middle = len(chunk) // 2
+            insert(chunk[:middle])
+            insert(chunk[middle:])
+
+    rows = list(rows)
+    for start in range(0, len(rows), batch_size):
+        insert(rows[start:start + batch_size])
+    cursor.close()
+    return inserted, failures
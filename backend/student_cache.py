@@ -0,0 +1,118 @@
+import os
+import threading
+from collections import OrderedDict
+
+STUDENT_CACHE_SIZE = int(os.environ.get("STUDENT_CACHE_SIZE", "50000"))
+
+
+class StudentCache:
+    """Bounded barcode -> (id, name, department) index used by /scan."""
+
+    def __init__(self, max_entries=STUDENT_CACHE_SIZE):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Held while a preload runs, so concurrent first lookups load once
+        self._load_lock = threading.Lock()
+        self._loaded = False
+        self.hits = 0
+        self.misses = 0
+
+    def preload(self, conn):
+        cursor = conn.cursor()
+        cursor.execute(
+            "SELECT barcode, id, name, department FROM students ORDER BY id DESC LIMIT %s",
+            (self.max_entries,))
+        entries = OrderedDict()
+        for barcode, student_id, name, department in reversed(cursor.fetchall()):
+            entries[barcode] = (student_id, name, department)
+        cursor.close()
+        with self._lock:
+            self._entries = entries
+            self._loaded = True
+        print(f"Student cache preloaded with {len(entries)} entries")
+
+    def ensure(self, conn):
+        if self._loaded:
+            return
+        with self._load_lock:
+            if not self._loaded:
+                self.preload(conn)
+
+    def get(self, barcode):
+        # Cache-only probe; a miss is counted by the lookup() that follows it
+        with self._lock:
+            student = self._entries.get(barcode) if self._loaded else None
+            if student is not None:
+                self._entries.move_to_end(barcode)
+                self.hits += 1
+            return student
+
+    def lookup(self, conn, barcode):
+        self.ensure(conn)
+        with self._lock:
+            student = self._entries.get(barcode)
+            if student is not None:
+                self._entries.move_to_end(barcode)
+                self.hits += 1
+                return student
+            self.misses += 1
+
+        cursor = conn.cursor()
+        cursor.execute("SELECT id, name, department FROM students WHERE barcode = %s", (barcode,))
+        student = cursor.fetchone()
+        cursor.close()
+        if student:
+            self.put(barcode, tuple(student))
+        return student
+
+    def lookup_many(self, conn, barcodes):
+        self.ensure(conn)
+        found = {}
+        missing = []
+        with self._lock:
+            for barcode in set(barcodes):
+                student = self._entries.get(barcode)
+                if student is not None:
+                    self._entries.move_to_end(barcode)
+                    self.hits += 1
+                    found[barcode] = student
+                else:
+                    self.misses += 1
+                    missing.append(barcode)
+
+        if missing:
+            cursor = conn.cursor()
+            placeholders = ", ".join(["%s"] * len(missing))
+            cursor.execute(
+                f"SELECT barcode, id, name, department FROM students WHERE barcode IN ({placeholders})",
+                tuple(missing))
+            for barcode, student_id, name, department in cursor.fetchall():
+                found[barcode] = (student_id, name, department)
+                self.put(barcode, found[barcode])
+            cursor.close()
+        return found
+
+    def put(self, barcode, student):
+        with self._lock:
+            self._entries[barcode] = student
+            self._entries.move_to_end(barcode)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self):
+        with self._lock:
+            self._entries = OrderedDict()
+            self._loaded = False
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "loaded": self._loaded,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0
+            }
@@ -0,0 +1,141 @@
+import threading
+from datetime import datetime, timedelta
+
+
+class TodayState:
+    """Per-student attendance state (id, time_in, time_out) for a single day."""
+
+    def __init__(self):
+        self.date = None
+        self._rows = {}
+        self.lock = threading.RLock()
+        self._timer = None
+
+    def is_loaded(self, date):
+        return self.date == date
+
+    def load(self, conn, date):
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT a.student_id, a.id, a.time_in, a.time_out,
+                   s.name, s.batch, s.position, s.department, s.school
+            FROM attendance a
+            JOIN students s ON a.student_id = s.id
+            WHERE a.date = %s
+            ORDER BY a.id
+        """, (date,))
+        rows = {row[0]: [row[1], row[2], row[3], row[4:]] for row in cursor.fetchall()}
+        cursor.close()
+        with self.lock:
+            self.date = date
+            self._rows = rows
+        print(f"Loaded {len(rows)} attendance rows for {date}")
+
+    def ensure(self, conn, date):
+        with self.lock:
+            if self.date != date:
+                self.load(conn, date)
+
+    def schedule_rollover(self, connect, tz):
+        # Reload at the next local midnight so the first scan of the day finds
+        # an empty table instead of paying for the load itself.
+        now = datetime.now(tz)
+        midnight = tz.localize(datetime.combine(now.date() + timedelta(days=1), datetime.min.time()))
+        self._timer = threading.Timer((midnight - now).total_seconds() + 1, self._roll_over, (connect, tz))
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _roll_over(self, connect, tz):
+        conn = None
+        try:
+            conn = connect()
+            self.ensure(conn, datetime.now(tz).date())
+        except Exception as e:
+            print(f"Attendance state rollover failed, will load on next scan: {str(e)}")
+        finally:
+            if conn is not None:
+                conn.close()
+            self.schedule_rollover(connect, tz)
+
+    def get(self, student_id, date):
+        with self.lock:
+            if self.date != date:
+                return None
+            record = self._rows.get(student_id)
+            return tuple(record[:3]) if record else None
+
+    def set(self, student_id, date, time_in, time_out, attendance_id=None):
+        with self.lock:
+            if self.date != date:
+                return
+            record = self._rows.get(student_id)
+            if record is None:
+                self._rows[student_id] = [attendance_id, time_in, time_out, None]
+            else:
+                record[1], record[2] = time_in, time_out
+                if attendance_id is not None:
+                    record[0] = attendance_id
+
+    def scan(self, student_id, date, time_str, on_change=None):
+        # Decide the transition; on_change runs under the lock before the state
+        # is updated, so if it raises the scan leaves no trace in memory. It
+        # must not block, or every scan waits behind it.
+        with self.lock:
+            if self.date != date:
+                raise LookupError(f"Attendance state not loaded for {date}")
+            record = self._rows.get(student_id)
+            if record is None:
+                status, time_in, time_out = "Time In", time_str, None
+            elif record[1] and not record[2]:
+                status, time_in, time_out = "Time Out", record[1], time_str
+            else:
+                return "Already Timed Out", record[1], record[2]
+            if on_change:
+                on_change(status, student_id, date, time_str)
+            if record is None:
+                self._rows[student_id] = [None, time_in, None, None]
+            else:
+                record[2] = time_out
+            return status, time_in, time_out
+
+    def forget_details(self, student_ids):
+        # Student details changed; records() fetches them again on next use
+        with self.lock:
+            for student_id in student_ids:
+                record = self._rows.get(student_id)
+                if record is not None:
+                    record[3] = None
+
+    def records(self, conn, date):
+        # Rows for /attendance; student details of new time-ins are fetched in one query
+        with self.lock:
+            if self.date != date:
+                return None
+            missing = [student_id for student_id, record in self._rows.items() if record[3] is None]
+        if missing:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT id, name, batch, position, department, school FROM students WHERE id IN ({', '.join(['%s'] * len(missing))})",
+                tuple(missing))
+            details = {row[0]: row[1:] for row in cursor.fetchall()}
+            cursor.close()
+        with self.lock:
+            if self.date != date:
+                return None
+            if missing:
+                for student_id in missing:
+                    if student_id in self._rows and student_id in details:
+                        self._rows[student_id][3] = details[student_id]
+            return [
+                {
+                    "name": record[3][0],
+                    "batch": record[3][1],
+                    "position": record[3][2],
+                    "department": record[3][3],
+                    "school": record[3][4],
+                    "date": date,
+                    "time_in": record[1],
+                    "time_out": record[2]
+                }
+                for record in self._rows.values() if record[3] is not None
+            ]
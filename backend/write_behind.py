@@ -0,0 +1,152 @@
+import os
+import queue
+import threading
+import time
+import traceback
+
+WRITE_BEHIND_ENABLED = os.environ.get("ATTENDANCE_WRITE_BEHIND", "0") in ("1", "true", "True")
+WRITE_BEHIND_FLUSH_MS = int(os.environ.get("WRITE_BEHIND_FLUSH_MS", "200"))
+WRITE_BEHIND_FLUSH_EVENTS = int(os.environ.get("WRITE_BEHIND_FLUSH_EVENTS", "500"))
+WRITE_BEHIND_QUEUE_SIZE = int(os.environ.get("WRITE_BEHIND_QUEUE_SIZE", "10000"))
+WRITE_BEHIND_DRAIN_TIMEOUT = float(os.environ.get("WRITE_BEHIND_DRAIN_TIMEOUT", "5"))
+
+
+class WriterBusy(Exception):
+    pass
+
+
+class AttendanceWriter:
+    """Background thread that group-commits queued time-in/time-out events."""
+
+    def __init__(self, connect, flush_ms=WRITE_BEHIND_FLUSH_MS, flush_events=WRITE_BEHIND_FLUSH_EVENTS,
+                 queue_size=WRITE_BEHIND_QUEUE_SIZE):
+        self.connect = connect
+        self.flush_interval = flush_ms / 1000.0
+        self.flush_events = flush_events
+        self._queue = queue.Queue(maxsize=queue_size)
+        # Events are numbered as they are queued; drain() waits for a number
+        # to be flushed rather than for the queue to be empty
+        self._submitted = 0
+        self._flushed = 0
+        self._progress = threading.Condition()
+        self._stopping = threading.Event()
+        self._thread = None
+        self.flushes = 0
+        self.flushed_events = 0
+        self.rejected = 0
+        self.failures = 0
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="attendance-writer", daemon=True)
+            self._thread.start()
+
+    def submit(self, status, student_id, date, time_str):
+        # Called under TodayState.lock, so never block here: a full queue is
+        # reported straight away instead of stalling every other scan
+        with self._progress:
+            try:
+                self._queue.put_nowait((status, student_id, date, time_str))
+            except queue.Full:
+                self.rejected += 1
+                raise WriterBusy("Attendance write queue is full, please scan again")
+            self._submitted += 1
+
+    def drain(self, timeout=WRITE_BEHIND_DRAIN_TIMEOUT):
+        # Wait until every event queued before this call has been committed;
+        # later scans don't hold it up. Flushes retry forever while the
+        # database is down, so give up after timeout.
+        deadline = time.monotonic() + timeout
+        with self._progress:
+            target = self._submitted
+            while self._flushed < target:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise WriterBusy("Attendance writes are not being committed, please try again")
+                self._progress.wait(remaining)
+
+    def stop(self):
+        # Flush-on-shutdown: the writer drains everything queued before exiting
+        self._stopping.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch:
+                self._flush(batch)
+                with self._progress:
+                    self._flushed += len(batch)
+                    self._progress.notify_all()
+            elif self._stopping.is_set():
+                return
+
+    def _collect(self):
+        batch = []
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.flush_events:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        if self._stopping.is_set():
+            while len(batch) < self.flush_events:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+        return batch
+
+    def _flush(self, batch):
+        time_ins = [(student_id, date, time_str) for status, student_id, date, time_str in batch if status == "Time In"]
+        time_outs = [(time_str, student_id, date) for status, student_id, date, time_str in batch if status == "Time Out"]
+        delay = 0.1
+        while True:
+            conn = None
+            try:
+                conn = self.connect()
+                cursor = conn.cursor()
+                if time_ins:
+                    cursor.executemany(
+                        "INSERT IGNORE INTO attendance (student_id, date, time_in) VALUES (%s, %s, %s)",
+                        time_ins)
+                if time_outs:
+                    cursor.executemany(
+                        "UPDATE attendance SET time_out = %s WHERE student_id = %s AND date = %s AND time_out IS NULL",
+                        time_outs)
+                conn.commit()
+                self.flushes += 1
+                self.flushed_events += len(batch)
+                return
+            except Exception as e:
+                self.failures += 1
+                print(f"Attendance write-behind flush of {len(batch)} events failed: {str(e)}\n{traceback.format_exc()}")
+                if conn is not None:
+                    try:
+                        conn.rollback()
+                    except Exception:
+                        pass
+                if self._stopping.is_set() and delay >= 5.0:
+                    print(f"Giving up on {len(batch)} attendance events during shutdown: {batch}")
+                    return
+                time.sleep(delay)
+                delay = min(delay * 2, 5.0)
+            finally:
+                if conn is not None:
+                    conn.close()
+
+    def stats(self):
+        return {
+            "enabled": self._thread is not None,
+            "queued": self._queue.qsize(),
+            "capacity": self._queue.maxsize,
+            "flushes": self.flushes,
+            "flushed_events": self.flushed_events,
+            "rejected": self.rejected,
+            "failures": self.failures
+        }
@@ -21,6 +21,36 @@ SET time_zone = "+00:00";
 -- Database: `attendance_db`
 --
 
+DELIMITER $$
+--
+-- Procedures
+--
+CREATE PROCEDURE `record_scan` (IN `p_student_id` INT, IN `p_date` DATE, IN `p_time` TIME)   BEGIN
+  DECLARE v_status VARCHAR(20);
+
+  INSERT IGNORE INTO `attendance` (`student_id`, `date`, `time_in`)
+  VALUES (p_student_id, p_date, p_time);
+
+  IF ROW_COUNT() = 1 THEN
+    SET v_status = 'Time In';
+  ELSE
+    UPDATE `attendance` SET `time_out` = p_time
+    WHERE `student_id` = p_student_id AND `date` = p_date
+      AND `time_in` IS NOT NULL AND `time_out` IS NULL;
+    IF ROW_COUNT() = 1 THEN
+      SET v_status = 'Time Out';
+    ELSE
+      SET v_status = 'Already Timed Out';
+    END IF;
+  END IF;
+
+  SELECT `id`, `time_in`, `time_out`, v_status AS `status`
+  FROM `attendance`
+  WHERE `student_id` = p_student_id AND `date` = p_date;
+END$$
+
+DELIMITER ;
+
 -- --------------------------------------------------------
 
 --
@@ -38,6 +68,47 @@ CREATE TABLE `attendance` (
 
 -- --------------------------------------------------------
 
+--
+-- Table structure for table `barcode_sequence`
+--
+
+CREATE TABLE `barcode_sequence` (
+  `id` tinyint(4) NOT NULL,
+  `next_value` bigint(20) NOT NULL DEFAULT 0,
+  `secret` varchar(64) NOT NULL
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+--
+-- Dumping data for table `barcode_sequence`
+-- (the secret is generated per install; see database/migrations/003)
+--
+
+INSERT INTO `barcode_sequence` (`id`, `next_value`, `secret`) VALUES
+(1, 0, SHA2(CONCAT(UUID(), RAND(), NOW(6)), 256));
+
+-- --------------------------------------------------------
+
+--
+-- Table structure for table `schema_migrations`
+--
+
+CREATE TABLE `schema_migrations` (
+  `version` int(11) NOT NULL,
+  `name` varchar(255) NOT NULL,
+  `applied_at` timestamp NOT NULL DEFAULT current_timestamp()
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+--
+-- Dumping data for table `schema_migrations`
+--
+
+INSERT INTO `schema_migrations` (`version`, `name`) VALUES
+(1, 'attendance_unique_student_date'),
+(2, 'attendance_query_indexes'),
+(3, 'barcode_sequence');
+
+-- --------------------------------------------------------
+
 --
 -- Table structure for table `students`
 --
@@ -81,14 +152,32 @@ INSERT INTO `users` (`id`, `username`, `password`) VALUES
 --
 ALTER TABLE `attendance`
   ADD PRIMARY KEY (`id`),
-  ADD KEY `student_id` (`student_id`);
+  ADD UNIQUE KEY `student_date` (`student_id`,`date`),
+  ADD KEY `date_student_times` (`date`,`student_id`,`time_in`,`time_out`),
+  ADD KEY `date_id` (`date`);
+
+--
+-- Indexes for table `barcode_sequence`
+--
+ALTER TABLE `barcode_sequence`
+  ADD PRIMARY KEY (`id`);
+
+--
+-- Indexes for table `schema_migrations`
+--
+ALTER TABLE `schema_migrations`
+  ADD PRIMARY KEY (`version`);
 
 --
 -- Indexes for table `students`
 --
 ALTER TABLE `students`
   ADD PRIMARY KEY (`id`),
-  ADD UNIQUE KEY `barcode` (`barcode`);
+  ADD UNIQUE KEY `barcode` (`barcode`),
+  ADD KEY `facets` (`batch`,`position`,`department`,`school`),
+  ADD KEY `department_school` (`department`,`school`),
+  ADD KEY `school` (`school`),
+  ADD KEY `position` (`position`);
 
 --
 -- Indexes for table `users`
@@ -0,0 +1,50 @@
+-- One attendance row per student per day, and a single-call time-in/time-out
+-- transition for /scan (backend/app3.py record_scan).
+
+-- Fold duplicate rows left behind by concurrent scans into the oldest row
+UPDATE `attendance` keep_row
+JOIN (
+  SELECT `student_id`, `date`, MIN(`id`) AS `id`, MAX(`time_out`) AS `time_out`
+  FROM `attendance`
+  GROUP BY `student_id`, `date`
+  HAVING COUNT(*) > 1
+) dup ON keep_row.`id` = dup.`id`
+SET keep_row.`time_out` = COALESCE(keep_row.`time_out`, dup.`time_out`);
+
+DELETE newer FROM `attendance` newer
+JOIN `attendance` older
+  ON newer.`student_id` = older.`student_id`
+ AND newer.`date` = older.`date`
+ AND newer.`id` > older.`id`;
+
+ALTER TABLE `attendance`
+  ADD UNIQUE KEY `student_date` (`student_id`, `date`);
+
+DROP PROCEDURE IF EXISTS `record_scan`;
+
+DELIMITER $$
+CREATE PROCEDURE `record_scan` (IN `p_student_id` INT, IN `p_date` DATE, IN `p_time` TIME)
+BEGIN
+  DECLARE v_status VARCHAR(20);
+
+  INSERT IGNORE INTO `attendance` (`student_id`, `date`, `time_in`)
+  VALUES (p_student_id, p_date, p_time);
+
+  IF ROW_COUNT() = 1 THEN
+    SET v_status = 'Time In';
+  ELSE
+    UPDATE `attendance` SET `time_out` = p_time
+    WHERE `student_id` = p_student_id AND `date` = p_date
+      AND `time_in` IS NOT NULL AND `time_out` IS NULL;
+    IF ROW_COUNT() = 1 THEN
+      SET v_status = 'Time Out';
+    ELSE
+      SET v_status = 'Already Timed Out';
+    END IF;
+  END IF;
+
+  SELECT `id`, `time_in`, `time_out`, v_status AS `status`
+  FROM `attendance`
+  WHERE `student_id` = p_student_id AND `date` = p_date;
+END$$
+DELIMITER ;
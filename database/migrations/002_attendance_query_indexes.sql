@@ -0,0 +1,23 @@
+-- Indexes for the /attendance, /attendance/download and /filters query shapes
+-- (backend/app3.py). `python migrate.py check` EXPLAINs those queries.
+
+-- Date filter joined to students, served from the index alone
+-- (time_in/time_out covered, id is the implicit InnoDB suffix)
+ALTER TABLE `attendance`
+  ADD KEY `date_student_times` (`date`, `student_id`, `time_in`, `time_out`);
+
+-- student_date (001) leads with student_id and serves the foreign key, so the
+-- old single-column index only costs every attendance insert another write
+ALTER TABLE `attendance`
+  DROP KEY `student_id`;
+
+-- ORDER BY date DESC, id DESC for unfiltered history and keyset pages
+ALTER TABLE `attendance`
+  ADD KEY `date_id` (`date`);
+
+-- Facet filters and the DISTINCT facet scans behind /filters
+ALTER TABLE `students`
+  ADD KEY `facets` (`batch`, `position`, `department`, `school`),
+  ADD KEY `department_school` (`department`, `school`),
+  ADD KEY `school` (`school`),
+  ADD KEY `position` (`position`);
@@ -0,0 +1,12 @@
+-- Counter and secret for backend/barcode_allocator.py. The secret keys the
+-- barcode permutation and must not change once barcodes have been issued.
+
+CREATE TABLE `barcode_sequence` (
+  `id` tinyint(4) NOT NULL,
+  `next_value` bigint(20) NOT NULL DEFAULT 0,
+  `secret` varchar(64) NOT NULL,
+  PRIMARY KEY (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_general_ci;
+
+INSERT INTO `barcode_sequence` (`id`, `next_value`, `secret`)
+VALUES (1, 0, SHA2(CONCAT(UUID(), RAND(), NOW(6)), 256));
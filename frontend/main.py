@@ -1,6 +1,7 @@
 import sys
 import requests
 import os
+import time
 from PyQt5.QtWidgets import (QApplication, QWidget, QVBoxLayout, QLabel, QLineEdit, QPushButton, QFileDialog, 
                             QMessageBox, QStackedWidget, QDesktopWidget, QSizePolicy, QTableWidget, 
                             QTableWidgetItem, QComboBox, QDateEdit, QFrame, QScrollArea, QHBoxLayout, QGridLayout)
@@ -512,6 +513,9 @@ class MainApp(QWidget):
             files = {"file": file}
             response = session.post(API_UPLOAD, files=files)
 
+        if response.status_code == 202:
+            response = self.wait_for_upload(response.json()["job_id"])
+
         if response.status_code == 200:
             filename = os.path.splitext(os.path.basename(self.file_path))[0] + "_processed.docx"
             if self.save_file_to_downloads(response.content, filename):
@@ -521,6 +525,29 @@ class MainApp(QWidget):
         else:
             self.label_upload.setText(f"Error processing file: {response.text}")
 
+    def wait_for_upload(self, job_id):
+        # The server processes rosters in the background; poll until the document is ready
+        while True:
+            status = session.get(f"{API_UPLOAD}/{job_id}")
+            if status.status_code != 200:
+                return status
+            job = status.json()
+            if job["status"] in ("done", "failed"):
+                errors = job.get("report", {}).get("errors", [])
+                if errors:
+                    lines = "\n".join(f"Row {error['row']}, {error['column']}: {error['error']}" for error in errors[:15])
+                    more = f"\n...and {len(errors) - 15} more" if len(errors) > 15 else ""
+                    QMessageBox.warning(self, "Roster Not Saved", f"Fix these problems and upload again:\n{lines}{more}")
+                failed = job.get("report", {}).get("failed", [])
+                if failed:
+                    rows = ", ".join(str(failure["row"]) for failure in failed)
+                    QMessageBox.warning(self, "Rows Skipped",
+                                        f"{len(failed)} row(s) were not saved (rows {rows}):\n{failed[0]['error']}")
+                return session.get(f"{API_UPLOAD}/{job_id}/result")
+            self.label_upload.setText(f"Processing: {job['stage']} ({job['percent']}%)")
+            QApplication.processEvents()
+            time.sleep(1)
+
     def logout(self):
         self.stack.setCurrentIndex(0)
         self.username_input.clear()
@@ -580,9 +607,15 @@ class MainApp(QWidget):
             QMessageBox.critical(self, "Error", "Failed to load attendance records.")
 
     def load_filters(self):
-        response = session.get(API_FILTERS)
+        headers = {}
+        if getattr(self, "filters_etag", None):
+            headers["If-None-Match"] = self.filters_etag
+        response = session.get(API_FILTERS, headers=headers)
+        if response.status_code == 304:
+            return
         if response.status_code == 200:
             data = response.json()
+            self.filters_etag = response.headers.get("ETag")
             
             self.batch_filter.clear()
             self.batch_filter.addItem("All", "")